@@ -0,0 +1,560 @@
+import io
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable
+
+import colorful as cf
+import pandas as pd
+from sqlalchemy import (Constraint, Engine, ForeignKeyConstraint, Integer,
+                        UniqueConstraint, and_, func, insert, select, text)
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import AddConstraint, DropConstraint
+
+from .base import Base
+from .db import get_session
+
+# rows sent to the database per executemany or COPY
+DEFAULT_BATCH_SIZE = 10_000
+# row batches a background writer holds before producers block
+DEFAULT_MAX_QUEUED = 8
+# databases where partitions can be loaded concurrently
+_parallel_dialects = ("postgresql", "mysql", "mariadb")
+
+
+class BatchWriter:
+    """
+    Buffers the rows of a table and writes them every batch_size rows, with
+    COPY on postgresql and executemany elsewhere. Only one batch is
+    converted for the database at a time, so memory does not grow with the
+    size of the table.
+
+    Columns that are not in the table are dropped. A writer can depend on
+    another one, which is flushed first so foreign keys to its rows are
+    satisfied.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        model: type[Base],
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        depends_on: "BatchWriter | None" = None,
+    ):
+        self.session = session
+        self.model = model
+        self.batch_size = batch_size
+        self.depends_on = depends_on
+        self.rows_written = 0
+
+        self._columns = [column.name for column in model.__table__.columns]
+        self._pending: list[pd.DataFrame] = []
+        self._num_pending = 0
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def write(self, rows: pd.DataFrame):
+        """
+        Queues rows, writing every full batch
+        """
+        if len(rows) == 0:
+            return
+
+        self._pending.append(self._table_rows(rows))
+        self._num_pending += len(rows)
+
+        if self._num_pending >= self.batch_size:
+            self._drain(partial=False)
+
+    def flush(self):
+        """
+        Writes every queued row
+        """
+        if self._num_pending > 0:
+            self._drain(partial=True)
+
+    def _table_rows(self, rows: pd.DataFrame) -> pd.DataFrame:
+        return rows[[column for column in self._columns if column in rows]]
+
+    def _drain(self, *, partial: bool):
+        rows = pd.concat(self._pending, ignore_index=True)
+
+        end = len(rows)
+        if not partial:
+            end -= len(rows) % self.batch_size
+
+        if self.depends_on is not None:
+            self.depends_on.flush()
+
+        for start in range(0, end, self.batch_size):
+            self._write_batch(rows.iloc[start : start + self.batch_size])
+
+        rows = rows.iloc[end:]
+        self._pending = [rows] if len(rows) > 0 else []
+        self._num_pending = len(rows)
+
+    def _write_batch(self, batch: pd.DataFrame):
+        write_rows(self.session, self.model, batch)
+
+        self.rows_written += len(batch)
+
+
+class ParallelBatchWriter(BatchWriter):
+    """
+    Splits the rows into id ranges of batch_size ids of the first primary
+    key column and loads every range as a partition, in its own
+    transaction, on a pool of connections of the session's engine. A range
+    is loaded once it holds batch_size rows, which is every id of the range
+    for tables with allocated ids, or when flushed.
+
+    Foreign key and unique checks are skipped, the constraints must be
+    deferred while loading. flush waits for every partition to be
+    committed.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        model: type[Base],
+        *,
+        executor: ThreadPoolExecutor,
+        max_in_flight: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        super().__init__(session, model, batch_size=batch_size)
+
+        self.executor = executor
+        # partitions loading or waiting for a connection
+        self.max_in_flight = max_in_flight
+
+        self._pk = model.__table__.primary_key.columns[0].name
+        self._ranges: dict[int, list[pd.DataFrame]] = {}
+        self._range_rows: dict[int, int] = {}
+        self._futures: deque[Future] = deque()
+
+    def write(self, rows: pd.DataFrame):
+        if len(rows) == 0:
+            return
+
+        rows = self._table_rows(rows)
+
+        for id_range, range_rows in rows.groupby(
+            rows[self._pk].to_numpy() // self.batch_size, sort=False
+        ):
+            self._ranges.setdefault(id_range, []).append(range_rows)
+            self._range_rows[id_range] = self._range_rows.get(
+                id_range, 0
+            ) + len(range_rows)
+
+            if self._range_rows[id_range] >= self.batch_size:
+                self._load_range(id_range)
+
+    def flush(self):
+        for id_range in list(self._ranges):
+            self._load_range(id_range)
+
+        while self._futures:
+            self._futures.popleft().result()
+
+    def _load_range(self, id_range: int):
+        rows = pd.concat(self._ranges.pop(id_range), ignore_index=True)
+        del self._range_rows[id_range]
+
+        self._futures.append(
+            self.executor.submit(
+                load_partition,
+                self.session.get_bind(),
+                self.model,
+                rows.sort_values(self._pk),
+            )
+        )
+
+        if len(self._futures) > self.max_in_flight:
+            self._futures.popleft().result()
+
+        self.rows_written += len(rows)
+
+
+def load_partition(engine: Engine, model: type[Base], rows: pd.DataFrame):
+    if engine.dialect.name == "postgresql":
+        with get_session(engine) as session:
+            write_rows(session, model, rows)
+        return
+
+    # the checks are connection state. A connection that may still have
+    # them disabled is invalidated instead of going back to the pool
+    with engine.connect() as connection:
+        try:
+            connection.execute(
+                text("SET foreign_key_checks = 0, unique_checks = 0")
+            )
+            connection.commit()
+
+            with Session(connection) as session:
+                write_rows(session, model, rows)
+                session.commit()
+
+            connection.execute(
+                text("SET foreign_key_checks = 1, unique_checks = 1")
+            )
+            connection.commit()
+        except BaseException:
+            connection.invalidate()
+            raise
+
+
+def defer_constraints(session: Session, model: type[Base]) -> list[Constraint]:
+    """
+    Returns the foreign key and unique constraints of the model's table,
+    which partitions don't check row by row. They are dropped on
+    postgresql. MySQL and MariaDB skip the checks on the loading
+    connections instead.
+
+    Triggers still run while the constraints are deferred, but they can't
+    rely on them. spaceship_crew_check looks up the crew's spaceship and
+    lets a crew member of a missing spaceship through, since its capacity
+    is NULL. restore_constraints catches those rows: AddConstraint
+    validates every crew row on postgresql and count_violations finds them
+    on MySQL and MariaDB.
+    """
+    constraints = [
+        constraint
+        for constraint in model.__table__.constraints
+        if isinstance(constraint, (ForeignKeyConstraint, UniqueConstraint))
+    ]
+
+    if session.get_bind().dialect.name == "postgresql":
+        for constraint in constraints:
+            session.execute(DropConstraint(constraint))
+
+    return constraints
+
+
+def restore_constraints(engine: Engine, constraints: list[Constraint]):
+    """
+    Adds back (postgresql) or checks (MySQL, MariaDB) deferred constraints,
+    each in its own transaction, removing them from the list as they are
+    handled. Every row is validated in one pass.
+
+    Raises once every constraint is handled if any of them is violated. On
+    postgresql the violated constraints are missing from the database.
+    """
+    violated = []
+
+    while constraints:
+        constraint = constraints.pop(0)
+        name = f"{constraint.table.name}.{constraint.name}"
+
+        try:
+            with get_session(engine) as session:
+                if engine.dialect.name == "postgresql":
+                    session.execute(AddConstraint(constraint))
+                elif num_violations := count_violations(session, constraint):
+                    raise ValueError(f"{num_violations} rows violate {name}")
+        except Exception as e:
+            print(cf.bold_red(f"Constraint {name} failed validation: {e}"))
+            violated.append(name)
+
+    if violated:
+        raise RuntimeError(
+            f"Loaded rows violate {', '.join(violated)}"
+            + (
+                ", the constraints are missing"
+                if engine.dialect.name == "postgresql"
+                else ""
+            )
+        )
+
+
+def count_violations(session: Session, constraint: Constraint) -> int:
+    """
+    Returns the number of rows violating a foreign key or unique constraint
+    """
+    table = constraint.table
+
+    if isinstance(constraint, ForeignKeyConstraint):
+        # aliased for self referencing foreign keys
+        referred = constraint.referred_table.alias()
+        referred_columns = [
+            referred.c[element.column.name] for element in constraint.elements
+        ]
+
+        return session.scalar(
+            select(func.count())
+            .select_from(
+                table.outerjoin(
+                    referred,
+                    and_(
+                        *(
+                            column == referred_column
+                            for column, referred_column in zip(
+                                constraint.columns, referred_columns
+                            )
+                        )
+                    ),
+                )
+            )
+            .where(
+                *(column != None for column in constraint.columns),
+                referred_columns[0] == None,
+            )
+        )
+
+    duplicates = (
+        select(*constraint.columns)
+        .group_by(*constraint.columns)
+        .having(func.count() > 1)
+        .subquery()
+    )
+
+    return session.scalar(select(func.count()).select_from(duplicates))
+
+
+def write_rows(session: Session, model: type[Base], rows: pd.DataFrame):
+    if session.get_bind().dialect.name == "postgresql":
+        copy_rows(session, model, rows)
+    else:
+        session.execute(insert(model), to_records(rows))
+
+
+def to_records(rows: pd.DataFrame) -> list[dict]:
+    return rows.assign(
+        # datetime objects, pandas timestamps can't go past 2262
+        **{
+            column: rows[column].array.to_pydatetime()
+            for column in rows.select_dtypes(["datetime", "datetimetz"])
+        },
+        # None instead of pd.NA for the nullable integer columns
+        **{
+            column: rows[column].to_numpy(dtype=object, na_value=None)
+            for column in rows.select_dtypes("Int64").columns
+        },
+    ).to_dict("records")
+
+
+def copy_rows(session: Session, model: type[Base], rows: pd.DataFrame):
+    """
+    Loads rows with COPY ... FROM STDIN (psycopg2). Empty values are NULL.
+    """
+    preparer = session.get_bind().dialect.identifier_preparer
+
+    # COPY skips the python side column defaults
+    rows = rows.assign(
+        **{
+            column.name: column.default.arg
+            for column in model.__table__.columns
+            if column.name not in rows
+            and column.default is not None
+            and column.default.is_scalar
+        }
+    )
+
+    # executemany casts floats into integer columns, COPY does not
+    integer_columns = [
+        column
+        for column in rows.select_dtypes("float").columns
+        if isinstance(model.__table__.columns[column].type, Integer)
+    ]
+
+    buffer = io.StringIO()
+    rows.astype({column: "Int64" for column in integer_columns}).to_csv(
+        buffer, index=False, header=False
+    )
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {preparer.format_table(model.__table__)} "
+            f"({', '.join(preparer.quote(column) for column in rows)}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+class BackgroundWriter:
+    """
+    Writes row batches on a dedicated thread with its own connection, so
+    the database works while the next rows are generated.
+
+    write queues rows for a table and blocks while max_queued batches are
+    waiting. barrier blocks until every queued row is committed, which must
+    happen before rows are read back or written from another session.
+    Errors on the writer thread are raised by the next write or barrier.
+
+    Rows of a table can reference rows of tables written before it. Rows
+    must not be modified once they are queued.
+
+    On server databases the rows of parallel_models are loaded in id range
+    partitions over num_connections connections, with their constraints
+    deferred until the next barrier. Deferred constraints are restored
+    even when loading fails.
+    """
+
+    _stop = object()
+
+    def __init__(
+        self,
+        engine: Engine,
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        parallel_models: Iterable[type[Base]] = (),
+        num_connections: int = 1,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.num_connections = num_connections
+        self.parallel_models = (
+            set(parallel_models)
+            if engine.dialect.name in _parallel_dialects
+            else set()
+        )
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(
+            target=self._run, name="background-writer", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queue.put(self._stop)
+        self._thread.join()
+
+        # don't hide the error that stopped the producer
+        if exc_type is None:
+            self._raise_error()
+
+    def write(self, model: type[Base], rows: pd.DataFrame):
+        self._raise_error()
+        self._queue.put((model, rows))
+
+    def barrier(self):
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+        self._raise_error()
+
+    def _make_writer(
+        self,
+        session: Session,
+        model: type[Base],
+        *,
+        writers: dict[type[Base], BatchWriter],
+        deferred: list[Constraint],
+        executor: ThreadPoolExecutor,
+    ) -> BatchWriter:
+        if model not in self.parallel_models:
+            return BatchWriter(
+                session,
+                model,
+                batch_size=self.batch_size,
+                depends_on=next(reversed(writers.values()), None),
+            )
+
+        # the partitions must see the rows written so far, and dropping the
+        # constraints locks the table until it is committed
+        for writer in writers.values():
+            writer.flush()
+
+        session.commit()
+        deferred.extend(defer_constraints(session, model))
+        session.commit()
+
+        return ParallelBatchWriter(
+            session,
+            model,
+            executor=executor,
+            max_in_flight=2 * self.num_connections,
+            batch_size=self.batch_size,
+        )
+
+    def _commit(
+        self,
+        session: Session,
+        writers: dict[type[Base], BatchWriter],
+        deferred: list[Constraint],
+    ):
+        for writer in writers.values():
+            writer.flush()
+
+        writers.clear()
+        session.commit()
+
+        restore_constraints(self.engine, deferred)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("Background writer failed") from self._error
+
+    def _run(self):
+        item = None
+        deferred: list[Constraint] = []
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.num_connections
+            ) as executor, get_session(self.engine) as session:
+                writers: dict[type[Base], BatchWriter] = {}
+
+                while (item := self._queue.get()) is not self._stop:
+                    if isinstance(item, threading.Event):
+                        self._commit(session, writers, deferred)
+                        item.set()
+                        continue
+
+                    model, rows = item
+
+                    if model not in writers:
+                        writers[model] = self._make_writer(
+                            session,
+                            model,
+                            writers=writers,
+                            deferred=deferred,
+                            executor=executor,
+                        )
+
+                    writers[model].write(rows)
+
+                self._commit(session, writers, deferred)
+        except BaseException as e:
+            self._error = e
+
+            # keep draining so producers and barriers are not left waiting
+            while item is not self._stop:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+                item = self._queue.get()
+        finally:
+            # never leave the tables without their constraints, on a fresh
+            # connection as the writer's one may be broken
+            if deferred:
+                try:
+                    restore_constraints(self.engine, deferred)
+                except Exception as e:
+                    if self._error is None:
+                        self._error = e
+
+
+__all__ = [
+    "BackgroundWriter",
+    "BatchWriter",
+    "DEFAULT_BATCH_SIZE",
+    "DEFAULT_MAX_QUEUED",
+    "ParallelBatchWriter",
+]
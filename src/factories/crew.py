@@ -1,274 +1,333 @@
-import math
-from functools import lru_cache
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple
 
 import colorful as cf
-import networkx as nx
 import numpy as np
 import pandas as pd
-from faker import Faker
-from sqlalchemy import Engine, func, insert, select, update
+from sqlalchemy import Engine, select
 
-from src.database.db import get_session
-from src.models import (Biome, Crew, CrewFriend, Fleet, Planet, ShipClass,
-                        ShipTemplate, Spaceship, StarSystem)
-from src.util import CURR_DATE, START_DATE, TIMEZONE
+from src.database.writer import BackgroundWriter
+from src.models import Biome, Crew, CrewFriend, Planet, StarSystem
+from src.util import CURR_DATE, START_DATE
 
 from .utils.empires_util import empires_info
-from .utils.ships_empire_util import empire_fleet_info
-from .utils.ships_util import ship_class_df
+from .utils.ids_util import IdAllocator
+from .utils.names_util import name_pool
+
+# reports_to of the crew that reports to nobody
+NO_MANAGER = -1
+
+
+class EmpireCrewTask(NamedTuple):
+    """
+    Everything a worker needs to generate the crew of one empire
+    """
+
+    rng: np.random.Generator
+    crew_ids: np.ndarray
+    ships: pd.DataFrame
+    planets: np.ndarray
+    num_subordinates: int
+
+
+class EmpireCrew(NamedTuple):
+    """
+    The crew of one empire and their friendships as plain arrays, so they
+    are cheap to send back from a worker. Names are name pool indices.
+    """
+
+    crew_id: np.ndarray
+    first_name: np.ndarray
+    last_name: np.ndarray
+    planet_of_birth_id: np.ndarray
+    spaceship_id: np.ndarray
+    birth_date: pd.arrays.DatetimeArray
+    hire_date: pd.arrays.DatetimeArray
+    command_points: np.ndarray
+    reports_to: np.ndarray
+    friend_crew_id: np.ndarray
+    friend_id: np.ndarray
 
 
 def add_crew(
     rng: np.random.Generator,
-    fake: Faker,
     *,
     engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
+    ships: pd.DataFrame,
 ):
     print(cf.yellow("Adding crew..."))
 
-    for i, ((_, e_gov_info), (_, e_fleet_info), num_subordinates) in enumerate(
-        zip(
-            empires_info(engine).iterrows(),
-            empire_fleet_info(engine, rng).iterrows(),
-            rng.integers(2, 11, size=len(empires_info(engine))),
-        )
+    habitable_planets = get_habitable_planets(engine)
+    empire_ships = dict(tuple(ships.groupby("empire_id")))
+    empires = empires_info(engine)
+
+    tasks = []
+
+    # every empire gets its own rng stream and ids, so the crew does not
+    # depend on which worker generates it
+    for (_, e_gov_info), num_subordinates, empire_rng in zip(
+        empires.iterrows(),
+        rng.integers(2, 11, size=len(empires)),
+        rng.spawn(len(empires)),
     ):
-        print(f"Adding crew for empire {i + 1}/{len(empires_info(engine))}")
-        for _, ship_class in ship_class_df().iterrows():
-            add_empire_crew(
-                engine,
-                fake=fake,
-                rng=rng,
-                gov_info=e_gov_info,
-                fleet_info=e_fleet_info,
-                ship_class=ship_class,
-            )
+        if e_gov_info["empire_id"] not in empire_ships:
+            continue
 
-        print(
-            f"Adding crew relationships for empire "
-            f"{i + 1}/{len(empires_info(engine))}"
-        )
-        add_crew_relationships(
-            engine,
-            rng,
-            empire_id=e_fleet_info["empire_id"],
-            num_subordinates=num_subordinates,
+        e_ships = empire_ships[e_gov_info["empire_id"]]
+
+        tasks.append(
+            EmpireCrewTask(
+                rng=empire_rng,
+                crew_ids=ids.allocate(Crew, e_ships["ship_crew"].sum()),
+                ships=e_ships[["spaceship_id", "ship_crew"]],
+                planets=get_crew_planets(
+                    habitable_planets,
+                    empire_rng,
+                    empire_id=e_gov_info["empire_id"],
+                    pct_foreign=e_gov_info["expansion_score"] / 100,
+                ),
+                num_subordinates=int(num_subordinates),
+            )
         )
 
+    if len(tasks) == 0:
+        return
 
-@lru_cache(maxsize=1)
-def get_crew_planets(engine: Engine, *, empire_id: int, pct_foreign: float):
-    with get_session(engine) as session:
-        crew_planet_ids = session.scalars(
-            select(Planet.planet_id)
-            .join(
-                StarSystem,
+    # build the name pool cache before the workers load it
+    name_pool()
+
+    max_workers = min(len(tasks), os.cpu_count() or 1)
+
+    # the writer threads are running, forking the process could deadlock
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        # results come back in empire order
+        for i, empire_crew in enumerate(
+            bounded_map(
+                executor,
+                generate_empire_crew,
+                tasks,
+                max_in_flight=2 * max_workers,
             )
-            .join(Biome)
-            .where(StarSystem.empire_owner == empire_id)
-            .where(Biome.biome_is_habitable == True)
-        ).all()
-        num_foreign_planets = int(len(crew_planet_ids) * pct_foreign)
+        ):
+            print(f"Adding crew for empire {i + 1}/{len(tasks)}")
+            crew, friends = crew_frames(empire_crew)
+            writer.write(Crew, crew)
+            writer.write(CrewFriend, friends)
+
+    writer.barrier()
+
 
-        # randomly order
-        foreign_planets = session.scalars(
-            select(Planet.planet_id)
-            .join(Biome)
-            .where(Biome.biome_is_habitable == True)
-            .order_by(func.random())
-            .limit(num_foreign_planets)
-        ).all()
+def bounded_map(
+    executor: Executor,
+    fn: Callable,
+    items: Iterable,
+    *,
+    max_in_flight: int,
+) -> Iterator:
+    """
+    Like executor.map, but only max_in_flight items are submitted ahead of
+    the consumer, so finished results don't pile up in memory while they
+    wait to be written.
+    """
+    pending = deque()
 
-    return crew_planet_ids + foreign_planets
+    for item in items:
+        pending.append(executor.submit(fn, item))
 
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
 
-def get_empire_ships(engine: Engine, *, empire_id: int, ship_class_id: int):
+    while pending:
+        yield pending.popleft().result()
+
+
+def get_habitable_planets(engine: Engine):
     return pd.read_sql(
-        select(Spaceship.spaceship_id)
-        .join(Fleet)
-        .join(ShipTemplate)
-        .join(ShipClass)
-        .where(Fleet.fleet_empire_owner == empire_id)
-        .where(ShipClass.ship_class_id == ship_class_id),
+        select(Planet.planet_id, StarSystem.empire_owner)
+        .join(StarSystem)
+        .join(Biome)
+        .where(Biome.biome_is_habitable == True)
+        .order_by(Planet.planet_id),
         engine,
     )
 
 
-def add_empire_crew(
-    engine: Engine,
-    *,
-    fake: Faker,
+def get_crew_planets(
+    habitable_planets: pd.DataFrame,
     rng: np.random.Generator,
-    gov_info: pd.Series,
-    fleet_info: pd.Series,
-    ship_class: pd.Series,
-):
-    num_ships = fleet_info[f"num_{ship_class['ship_class_name']}"]
+    *,
+    empire_id: int,
+    pct_foreign: float,
+) -> np.ndarray:
+    planet_ids = habitable_planets["planet_id"].to_numpy()
+
+    crew_planet_ids = planet_ids[
+        habitable_planets["empire_owner"].to_numpy() == empire_id
+    ]
+    num_foreign_planets = min(
+        int(len(crew_planet_ids) * pct_foreign), len(planet_ids)
+    )
 
-    if num_ships == 0:
-        return
+    foreign_planets = rng.choice(
+        planet_ids, num_foreign_planets, replace=False
+    )
 
-    with get_session(engine) as session:
-        session.execute(
-            insert(Crew),
-            crew_val_helper(
-                fake,
-                rng,
-                planets=get_crew_planets(
-                    engine,
-                    empire_id=fleet_info["empire_id"],
-                    pct_foreign=gov_info["expansion_score"] / 100,
-                ),
-                crew_per_ship=ship_class["ship_crew"],
-                ships=get_empire_ships(
-                    engine,
-                    empire_id=fleet_info["empire_id"],
-                    ship_class_id=ship_class.name,
-                ),
+    return np.concatenate((crew_planet_ids, foreign_planets))
+
+
+def generate_empire_crew(task: EmpireCrewTask) -> EmpireCrew:
+    """
+    Generates the crew of every ship of an empire, with their hierarchy,
+    and their friendships. Runs in a worker process.
+    """
+    rng = task.rng
+
+    crew = crew_val_helper(rng, planets=task.planets, ships=task.ships)
+
+    # rows are inserted in hierarchy order, managers before their crew
+    crew_ids = rng.permutation(task.crew_ids)
+
+    if len(crew_ids) < 2:
+        friend_crew_id = friend_id = np.empty(0, dtype=crew_ids.dtype)
+    else:
+        friend_crew_id, friend_id = create_friends_graph(crew_ids, rng)
+
+    return EmpireCrew(
+        crew_id=crew_ids,
+        reports_to=create_reports_to(
+            crew_ids, num_subordinates=task.num_subordinates
+        ),
+        friend_crew_id=friend_crew_id,
+        friend_id=friend_id,
+        **crew,
+    )
+
+
+def crew_frames(crew: EmpireCrew) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Builds the crew and crew friend rows of a worker's arrays
+    """
+    crew_rows = pd.DataFrame(
+        {
+            "crew_id": crew.crew_id,
+            "crew_name": name_pool().join(crew.first_name, crew.last_name),
+            "planet_of_birth_id": crew.planet_of_birth_id,
+            "spaceship_id": crew.spaceship_id,
+            "birth_date": crew.birth_date,
+            "hire_date": crew.hire_date,
+            "command_points": crew.command_points,
+            "reports_to": pd.arrays.IntegerArray(
+                crew.reports_to, mask=crew.reports_to == NO_MANAGER
             ),
-        )
+        }
+    )
+    friend_rows = pd.DataFrame(
+        {"crew_id": crew.friend_crew_id, "friend_id": crew.friend_id}
+    )
+
+    return crew_rows, friend_rows
 
 
 def crew_val_helper(
-    fake: Faker,
     rng: np.random.Generator,
     *,
-    planets: list[int],
-    crew_per_ship: int,
+    planets: np.ndarray,
     ships: pd.DataFrame,
-):
-    for ship_id in ships["spaceship_id"]:
-        for _ in range(crew_per_ship):
-            birth = fake.date_time_between(
-                start_date=START_DATE, end_date=CURR_DATE, tzinfo=TIMEZONE
-            )
-            hire = fake.date_time_between(
-                start_date=birth, end_date=CURR_DATE, tzinfo=TIMEZONE
-            )
-            yield {
-                "crew_name": fake.name(),
-                "planet_of_birth_id": int(rng.choice(planets)),
-                "spaceship_id": ship_id,
-                "birth_date": birth,
-                "hire_date": hire,
-                "command_points": ((CURR_DATE - hire).days // 365),
-            }
+) -> dict[str, np.ndarray]:
+    """
+    Creates ship_crew crew members for every ship. Birth dates are uniform
+    between START_DATE and CURR_DATE, hire dates between birth and CURR_DATE.
+    """
+    spaceship_id = np.repeat(ships["spaceship_id"], ships["ship_crew"])
+    num_crew = len(spaceship_id)
 
+    # drawn as UTC seconds, then localized like START_DATE and CURR_DATE
+    start = np.datetime64(START_DATE.replace(tzinfo=None), "s")
+    curr = np.datetime64(CURR_DATE.replace(tzinfo=None), "s")
 
-def get_empire_crew(engine: Engine, *, empire_id: int):
-    return pd.read_sql(
-        select(Crew.crew_id)
-        .join(Spaceship)
-        .join(Fleet)
-        .where(Fleet.fleet_empire_owner == empire_id),
-        engine,
+    birth = start + rng.integers(0, (curr - start).astype(int), num_crew)
+    hire = birth + (rng.random(num_crew) * (curr - birth).astype(int)).astype(
+        int
     )
+    birth = pd.to_datetime(birth, utc=True)
+    hire = pd.to_datetime(hire, utc=True)
 
+    first_name, last_name = name_pool().draw(rng, num_crew)
 
-def add_crew_relationships(
-    engine: Engine,
-    rng: np.random.Generator,
-    *,
-    empire_id: int,
-    num_subordinates: int,
-):
-    crew = get_empire_crew(engine, empire_id=empire_id)
-
-    with get_session(engine) as session:
-        # update the crew table with new crew relationships
-        session.execute(
-            update(Crew),
-            create_reports_to(
-                crew,
-                rng,
-                num_subordinates=num_subordinates,
-            ),
-        )
-        session.execute(
-            insert(CrewFriend),
-            create_friends_graph(
-                crew,
-                rng,
-            ),
-        )
-
-
-def node_to_crew_map(
-    rng: np.random.Generator,
-    crew_ids: pd.Series,
-    g: nx.Graph,
-):
     return {
-        node: crew_id
-        for crew_id, node in zip(
-            rng.choice(crew_ids, size=len(crew_ids), replace=False),
-            g,
-        )
+        "first_name": first_name,
+        "last_name": last_name,
+        "planet_of_birth_id": rng.choice(planets, num_crew),
+        "spaceship_id": spaceship_id.to_numpy(),
+        "birth_date": birth.array,
+        "hire_date": hire.array,
+        "command_points": (CURR_DATE - hire).days.to_numpy() // 365,
     }
 
 
 def create_reports_to(
-    crew: pd.DataFrame,
-    rng: np.random.Generator,
+    crew_ids: np.ndarray,
     *,
     num_subordinates: int,
-):
+) -> np.ndarray:
     """
-    Creates a balanced n-ry tree that determines the crew hierarchy
+    The crew are the nodes of a complete n-ry tree in order, crew i reports
+    to crew (i - 1) // num_subordinates. The first crew reports to nobody
+    (NO_MANAGER).
     """
-    max_depth = math.ceil(math.log(len(crew), num_subordinates))
+    managers = (np.arange(1, len(crew_ids)) - 1) // num_subordinates
 
-    g = nx.balanced_tree(num_subordinates, max_depth, nx.DiGraph)
+    return np.concatenate(([NO_MANAGER], crew_ids[managers]))
 
-    # map crew_id to node and remove nodes that don't have crew
-    node_to_crew = node_to_crew_map(
-        rng,
-        crew["crew_id"],
-        g,
-    )
 
-    report_to_update = []
+def dorogovtsev_goltsev_mendes_edges(
+    num_nodes: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Edges of a Dorogovtsev-Goltsev-Mendes graph with exactly num_nodes
+    nodes. Starting from a single edge, every generation adds a node
+    connected to both ends of every existing edge. The last generation
+    stops once num_nodes nodes exist.
+    """
+    src, dst = np.array([0]), np.array([1])
+    nodes = 2
 
-    for node in node_to_crew:
-        manager = list(g.predecessors(node))
+    while nodes < num_nodes:
+        num_new = min(len(src), num_nodes - nodes)
+        new_nodes = np.arange(nodes, nodes + num_new)
 
-        if len(manager) == 0:
-            continue
+        src = np.concatenate((src, src[:num_new], dst[:num_new]))
+        dst = np.concatenate((dst, new_nodes, new_nodes))
+        nodes += num_new
 
-        report_to_update.append(
-            {
-                "crew_id": int(node_to_crew[node]),
-                "reports_to": int(node_to_crew[manager[0]]),
-            }
-        )
-
-    return report_to_update
+    return src, dst
 
 
 def create_friends_graph(
-    crew: pd.DataFrame,
+    crew_ids: np.ndarray,
     rng: np.random.Generator,
-):
-    """
-    Creates a dorogovtsev_goltsev_mendes_graph of size
-    ceil(log_3(len(crew) / 3 - 1))
+) -> tuple[np.ndarray, np.ndarray]:
     """
-    dgmg_n = math.ceil(math.log(len(crew) / 3 - 1, 3))
+    Creates a Dorogovtsev-Goltsev-Mendes graph of the crew size and maps its
+    nodes to the crew at random. Friendships go both ways.
 
-    g = nx.dorogovtsev_goltsev_mendes_graph(n=dgmg_n)
+    Returns the crew and friend id of every friendship.
+    """
+    src, dst = dorogovtsev_goltsev_mendes_edges(len(crew_ids))
+    node_to_crew = rng.permutation(crew_ids)
 
-    node_to_crew = node_to_crew_map(
-        rng,
-        crew["crew_id"],
-        g,
+    return (
+        node_to_crew[np.concatenate((src, dst))],
+        node_to_crew[np.concatenate((dst, src))],
     )
 
-    for node in node_to_crew:
-        for neighbor in g.neighbors(node):
-            yield {
-                "crew_id": int(node_to_crew[node]),
-                "friend_id": int(node_to_crew[neighbor]),
-            }
-
 
 __all__ = ["add_crew"]
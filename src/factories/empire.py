@@ -7,7 +7,8 @@ from src.database.db import get_session
 from src.models import Empire, EmpireAuthority, EmpireEthic, EmpireToEthic
 from src.util import get_location
 
-from .utils.empires_util import authority_df, empire_id_range, ethic_df
+from .utils.empires_util import authority_df, ethic_df
+from .utils.ids_util import IdAllocator
 from .utils.util import load_file
 
 
@@ -30,7 +31,12 @@ def create_empire_ethics(engine: Engine):
 
 
 def create_empires(
-    fake: Faker, *, rng: np.random.Generator, num_empires: int, engine: Engine
+    fake: Faker,
+    *,
+    rng: np.random.Generator,
+    num_empires: int,
+    engine: Engine,
+    ids: IdAllocator,
 ):
     create_empire_authorities(engine)
     create_empire_ethics(engine)
@@ -39,11 +45,13 @@ def create_empires(
         fake=fake,
         num_empires=num_empires,
         engine=engine,
+        ids=ids,
     )
 
     create_empire_to_ethic(
         rng=rng,
         engine=engine,
+        ids=ids,
     )
 
 
@@ -52,6 +60,7 @@ def create_empires_helper(
     *,
     num_empires: int,
     engine: Engine,
+    ids: IdAllocator,
 ):
     empire_species_file = "assets/empire_species.txt"
     empire_suffix_file = "assets/empire_suffix.txt"
@@ -65,10 +74,12 @@ def create_empires_helper(
             insert(Empire),
             [
                 {
+                    "empire_id": int(empire_id),
                     "empire_name": f"{species} {suffix}",
                     "empire_authority_id": auth_id,
                 }
-                for auth_id, species, suffix in zip(
+                for empire_id, auth_id, species, suffix in zip(
+                    ids.allocate(Empire, num_empires),
                     fake.random_elements(
                         elements=authority_df().index,
                         length=num_empires,
@@ -87,7 +98,7 @@ def create_empires_helper(
         )
 
 
-def generate_empire_ethics(rng: np.random.Generator, *, engine: Engine):
+def generate_empire_ethics(rng: np.random.Generator, *, ids: IdAllocator):
     min_num_ethics = 2
     max_num_ethics = 3
     base_ethic_attraction = 1
@@ -95,16 +106,16 @@ def generate_empire_ethics(rng: np.random.Generator, *, engine: Engine):
 
     print(cf.yellow("Adding empire to ethic..."))
 
-    min_id, max_id = empire_id_range(engine)
+    empire_ids = ids.ids(Empire)
 
     empire_ethics = []
     for num_ethics, empire_id in zip(
         rng.integers(
             low=min_num_ethics,
             high=max_num_ethics + 1,
-            size=max_id - min_id + 1,
+            size=len(empire_ids),
         ),
-        range(min_id, max_id + 1),
+        empire_ids.tolist(),
     ):
         new_ethics = [
             {
@@ -131,8 +142,10 @@ def generate_empire_ethics(rng: np.random.Generator, *, engine: Engine):
     return empire_ethics
 
 
-def create_empire_to_ethic(rng: np.random.Generator, *, engine: Engine):
-    empire_ethics = generate_empire_ethics(rng, engine=engine)
+def create_empire_to_ethic(
+    rng: np.random.Generator, *, engine: Engine, ids: IdAllocator
+):
+    empire_ethics = generate_empire_ethics(rng, ids=ids)
 
     with get_session(engine) as session:
         session.execute(
@@ -1,54 +1,120 @@
 import colorful as cf
+import numpy as np
 import pandas as pd
 from sqlalchemy import Engine, func, select, update
+from sqlalchemy.orm import Session
 
 from src.database.db import get_session
-from src.factories.utils.empires_util import empires_info, get_empire_resources
-from src.factories.utils.ships_util import ship_class_df
-from src.models import (Biome, Empire, Fleet, Planet, ShipTemplate,
-                        ShipTemplateModule, Spaceship, SpaceshipModule,
-                        SpaceshipRank, StarSystem)
+from src.factories.utils.empires_util import get_empire_resources
+from src.factories.utils.ships_util import ship_rank_multiplier
+from src.models import (EMPIRE_SCORE_WEIGHTS, Biome, Empire, Planet,
+                        StarSystem, add_empire_score_triggers)
 from src.util import df_info
 
 
-def calculate_empire_score(engine: Engine, rng):
+def calculate_empire_score(
+    engine: Engine,
+    rng,
+    *,
+    ships: pd.DataFrame,
+    templates_power: pd.Series,
+):
+    """
+    Stores every component of the empire score and the score itself. The
+    score is then maintained by the empire score triggers on PostgreSQL.
+    Other databases are not updated automatically, see
+    apply_empire_score_delta.
+
+    Fleet power is computed from the generated ships and the power of their
+    templates (indexed by ship_template_id).
+    """
     print(cf.yellow("Calculating empire score..."))
 
-    scores_df = get_empire_info_df(engine)
+    scores_df = get_empire_info_df(engine, ships, templates_power)
 
     scores_df["empire_score"] = (
-        # economic strength
-        scores_df["total_energy"]
-        + scores_df["total_minerals"]
-        # technology
-        + scores_df["total_research"] * 6
-        # economy
-        + scores_df["total_trade"]
-        # expansion
-        + scores_df["num_systems"] * 10000
-        + scores_df["colonies_count"] * 50000
-        + scores_df["num_pops"] * 20000
+        sum(
+            scores_df[col] * weight
+            for col, weight in EMPIRE_SCORE_WEIGHTS.items()
+            if col != "empire_fleet_power"
+        )
         # fleet power
-        + scores_df["fleet_power"]
-    )
+        + scores_df["empire_fleet_power"].round()
+    ).astype(int)
 
     with get_session(engine) as session:
         session.execute(
             update(Empire),
-            scores_df[["empire_id", "empire_score"]].to_dict(orient="records"),
+            scores_df[
+                ["empire_id", "empire_score", *EMPIRE_SCORE_WEIGHTS]
+            ].to_dict(orient="records"),
+        )
+
+    add_empire_score_triggers(engine)
+
+
+def apply_empire_score_delta(
+    session: Session, empire_id: int | None, deltas: dict[str, int]
+):
+    """
+    Adds deltas to the score components of an empire and its score.
+
+    Only PostgreSQL has the empire score triggers. On other databases
+    nothing calls this automatically: code that changes planets or star
+    systems after calculate_empire_score must call it in the same session,
+    with the change of every component (keys of EMPIRE_SCORE_WEIGHTS except
+    empire_fleet_power), or the stored score goes stale. Fleet power is
+    kept up to date by src.factories.fleet_power.
+    """
+    if empire_id is None:
+        return
+
+    session.execute(
+        update(Empire)
+        .where(Empire.empire_id == empire_id)
+        .values(
+            empire_score=Empire.empire_score
+            + sum(
+                delta * EMPIRE_SCORE_WEIGHTS[col]
+                for col, delta in deltas.items()
+            ),
+            **{
+                col: getattr(Empire, col) + delta
+                for col, delta in deltas.items()
+            },
         )
+        .execution_options(synchronize_session=False)
+    )
 
 
-def get_empire_info_df(engine: Engine):
+def get_empire_info_df(
+    engine: Engine, ships: pd.DataFrame, templates_power: pd.Series
+):
     scores_df = get_empire_resources(engine).sort_values(by="empire_id")
 
-    scores_df = scores_df.merge(
-        empires_info(engine)[["empire_id", "num_systems"]], on="empire_id"
-    )
+    scores_df = systems_info(engine, scores_df)
     scores_df = colonies_info(engine, scores_df)
-    scores_df = fleet_info(engine, scores_df)
+    scores_df = fleet_info(engine, scores_df, ships, templates_power)
 
-    return scores_df
+    return scores_df.rename(
+        columns={
+            col.removeprefix("empire_"): col for col in EMPIRE_SCORE_WEIGHTS
+        }
+    )
+
+
+def systems_info(engine: Engine, scores_df: pd.DataFrame) -> pd.DataFrame:
+    num_systems = pd.read_sql(
+        select(
+            StarSystem.empire_owner.label("empire_id"),
+            func.count(StarSystem.star_system_id).label("num_systems"),
+        )
+        .where(StarSystem.empire_owner != None)
+        .group_by(StarSystem.empire_owner),
+        engine,
+    )
+
+    return scores_df.merge(num_systems, on="empire_id")
 
 
 def colonies_info(engine: Engine, scores_df: pd.DataFrame) -> pd.DataFrame:
@@ -74,56 +140,68 @@ def colonies_info(engine: Engine, scores_df: pd.DataFrame) -> pd.DataFrame:
     return scores_df
 
 
-def fleet_info(engine: Engine, scores_df: pd.DataFrame) -> pd.DataFrame:
-    xp_info = pd.read_sql(select(SpaceshipRank), engine)
-
-    df_power = scores_df[["empire_id"]].copy()
-
-    for _, rank in xp_info.iterrows():
-        for _, ship_class in ship_class_df().iterrows():
-            label = f"{rank.spaceship_rank_name}_{ship_class.ship_class_name}_power"
-
-            empires_ships = pd.read_sql(
-                select(
-                    Empire.empire_id,
-                    func.sum(
-                        ShipTemplateModule.ship_module_count
-                        * SpaceshipModule.spaceship_module_power
-                        * (1 + rank.spaceship_bonus_power)
-                    ).label(label),
-                )
-                .join(Fleet)
-                .join(Spaceship)
-                .join(ShipTemplate)
-                .join(ShipTemplateModule)
-                .join(SpaceshipModule)
-                .where(
-                    Spaceship.spaceship_experience
-                    >= rank.spaceship_min_experience,
-                )
-                .where(
-                    Spaceship.spaceship_experience
-                    < rank.spaceship_max_experience,
-                )
-                .where(
-                    ShipTemplate.ship_class_id == ship_class.name,
-                )
-                .group_by(Empire.empire_id),
-                engine,
-            )
-
-            df_power = df_power.merge(
-                empires_ships, on="empire_id", how="left"
-            )
-
-    # fill any NaNs with 0
-    df_power = df_power.fillna(0)
-    # add the power columns together
-    df_power["fleet_power"] = df_power.sum(axis=1) - df_power["empire_id"]
-
-    # merge the power columns with the scores_df
-    scores_df = scores_df.merge(
-        df_power[["empire_id", "fleet_power"]], on="empire_id"
+def fleet_power_from_ships(
+    ships: pd.DataFrame, templates_power: pd.Series
+) -> pd.DataFrame:
+    """
+    In memory equivalent of the fleet power rollup. ships needs the
+    empire_id, spaceship_template_id and spaceship_experience columns.
+    """
+    power = templates_power.reindex(
+        ships["spaceship_template_id"], fill_value=0
+    ).to_numpy() * ship_rank_multiplier(
+        ships["spaceship_experience"].to_numpy()
     )
 
+    empire_ids, empire_idx = np.unique(ships["empire_id"], return_inverse=True)
+
+    return pd.DataFrame(
+        {
+            "empire_id": empire_ids,
+            "fleet_power": np.bincount(empire_idx, weights=power),
+        }
+    )
+
+
+def check_fleet_power(engine: Engine, scores_df: pd.DataFrame):
+    """
+    Makes sure the fleet power computed in memory matches the rollup
+    maintained by src.factories.fleet_power
+    """
+    rollup = pd.read_sql(
+        select(Empire.empire_id, Empire.empire_fleet_power), engine
+    ).merge(scores_df[["empire_id", "fleet_power"]], on="empire_id")
+
+    mismatch = ~np.isclose(
+        rollup["empire_fleet_power"].fillna(0), rollup["fleet_power"]
+    )
+
+    if mismatch.any():
+        raise ValueError(
+            "Fleet power of empires "
+            f"{rollup.loc[mismatch, 'empire_id'].tolist()} doesn't match "
+            "the fleet power rollup"
+        )
+
+
+def fleet_info(
+    engine: Engine,
+    scores_df: pd.DataFrame,
+    ships: pd.DataFrame,
+    templates_power: pd.Series,
+) -> pd.DataFrame:
+    df_power = fleet_power_from_ships(ships, templates_power)
+
+    # empires without ships have no fleet power
+    scores_df = scores_df.merge(df_power, on="empire_id", how="left")
+    scores_df["fleet_power"] = scores_df["fleet_power"].fillna(0)
+
+    check_fleet_power(engine, scores_df)
+
     return scores_df
+
+
+__all__ = [
+    "apply_empire_score_delta",
+    "calculate_empire_score",
+]
@@ -1,111 +1,77 @@
 import math
-from functools import lru_cache
 
 import colorful as cf
 import numpy as np
 import pandas as pd
-from sqlalchemy import Engine, delete, select, update
+from sqlalchemy import Engine, select, update
 
 from src.database.db import get_session
 from src.models import Biome, Empire, Planet, StarSystem
 
-from .utils.empires_util import empire_id_range, empires_info, ethic_df
+from .utils.empires_util import empires_info, ethic_attraction_matrix, ethic_df
+from .utils.hyperlanes_util import Hyperlanes, grow_territories
+from .utils.ids_util import IdAllocator
 
-_h_planet_page_size = 1000
 
-
-@lru_cache(maxsize=3)
-def get_habitable_planets(engine: Engine, page: int = 0):
-    print(cf.yellow("Getting habitable planets..."))
-
-    planets_stmt = (
-        select(StarSystem.star_system_id)
-        .distinct()
-        .join(Planet)
-        .join(Biome)
-        .filter(Biome.biome_is_habitable == True)
-        .order_by(StarSystem.star_system_id)
-        .limit(_h_planet_page_size)
-        .offset(page * _h_planet_page_size)
-    )
-    df = pd.read_sql_query(planets_stmt, con=engine)
-
-    return df
-
-
-def remove_excess_empires(engine: Engine):
+def get_habitable_systems(engine: Engine) -> np.ndarray:
     """
-    Removes all empires with no star systems.
-
-    REQUIRES ON DELETE CASCADE on EmpireToEthic N:M table.
+    Returns the ids of all star systems with at least one habitable planet
     """
+    print(cf.yellow("Getting habitable star systems..."))
+
     with get_session(engine) as session:
-        deleted_empires = session.execute(
-            delete(Empire).where(
-                Empire.empire_id.notin_(
-                    select(StarSystem.empire_owner)
-                    .distinct()
-                    .where(StarSystem.empire_owner != None)
-                )
-            )
-        )
-        print(
-            cf.yellow(
-                f"Deleted {deleted_empires.rowcount} empires with no star systems."
-            )
+        return np.array(
+            session.scalars(
+                select(StarSystem.star_system_id)
+                .distinct()
+                .join(Planet)
+                .join(Biome)
+                .where(Biome.biome_is_habitable == True)
+                .order_by(StarSystem.star_system_id)
+            ).all()
         )
 
 
 def assign_home_systems(
-    engine: Engine, num_empires: int, rng: np.random.Generator
+    engine: Engine,
+    rng: np.random.Generator,
+    *,
+    ids: IdAllocator,
+    num_empires: int,
+    habitable_systems: np.ndarray,
 ):
-    num_pages = math.ceil(num_empires / _h_planet_page_size)
-    min_id, max_id = empire_id_range(engine)
-    empires = rng.choice(
-        np.arange(min_id, max_id + 1), size=num_empires, replace=False
-    )
-
-    stars_to_empires = dict()
-    for page, empires_idx in zip(
-        range(num_pages), range(0, len(empires), _h_planet_page_size)
-    ):
-        habitable_stars = get_habitable_planets(engine, page=page)
-
-        if len(habitable_stars) == 0:
-            # means we've run out of habitable star systems
-            break
-
-        # NOTE: this end_idx is for slicing (not inclusive)
-        end_idx = min(empires_idx + _h_planet_page_size, num_empires)
-        empires_assign = empires[empires_idx:end_idx]
-        num_to_assign = min(len(empires_assign), len(habitable_stars))
-
-        stars_to_empires.update(
-            dict(
-                zip(
-                    rng.choice(
-                        habitable_stars.star_system_id.unique(),
-                        size=num_to_assign,
-                        replace=False,
-                    ),
-                    empires_assign,
-                )
-            )
+    """
+    Gives every empire a random habitable home system. There must be at
+    least num_empires habitable star systems.
+    """
+    empires = rng.choice(ids.ids(Empire), size=num_empires, replace=False)
+
+    stars_to_empires = dict(
+        zip(
+            rng.choice(
+                habitable_systems,
+                size=num_empires,
+                replace=False,
+            ),
+            empires,
         )
+    )
 
     save_home_systems(engine, stars_to_empires)
-    # # remove excess empires
-    remove_excess_empires(engine)
 
 
 def save_home_systems(engine: Engine, stars_to_empires: dict[int, int]):
     with get_session(engine) as session:
-        for star_system_id, empire_id in stars_to_empires.items():
-            session.execute(
-                update(StarSystem)
-                .where(StarSystem.star_system_id == int(star_system_id))
-                .values(empire_owner=int(empire_id))
-            )
+        session.execute(
+            update(StarSystem),
+            [
+                {
+                    "star_system_id": int(star_system_id),
+                    "empire_owner": int(empire_id),
+                }
+                for star_system_id, empire_id in stars_to_empires.items()
+            ],
+        )
 
 
 def add_empire_expansion_score(df: pd.DataFrame, rng: np.random.Generator):
@@ -118,14 +84,8 @@ def add_empire_expansion_score(df: pd.DataFrame, rng: np.random.Generator):
         )
     }
 
-    df["expansion_score"] = df.apply(
-        lambda row: sum(
-            expansion_score[ethic_id] * ethic_attraction
-            for ethic_id, ethic_attraction in zip(
-                row["empire_ethic_id"], row["empire_ethic_attraction"]
-            )
-        ),
-        axis=1,
+    df["expansion_score"] = ethic_attraction_matrix(df) @ np.array(
+        [expansion_score[ethic_id] for ethic_id in ethics.index]
     )
 
     return df
@@ -170,56 +130,90 @@ def assign_num_systems(
     return df
 
 
+def get_star_system_owners(engine: Engine) -> pd.DataFrame:
+    return pd.read_sql(
+        select(StarSystem.star_system_id, StarSystem.empire_owner).order_by(
+            StarSystem.star_system_id
+        ),
+        engine,
+    )
+
+
 def update_empire_stars(
-    engine: Engine, empire_df: pd.DataFrame, rng: np.random.Generator
+    engine: Engine,
+    empire_df: pd.DataFrame,
+    rng: np.random.Generator,
+    hyperlanes: Hyperlanes,
 ):
+    """
+    Grows each empire's territory outwards from its home system along the
+    hyperlanes. Node i of the hyperlane map is the i-th star system by id.
+    """
+    systems = get_star_system_owners(engine)
+
+    # home systems are the only owned systems so far
+    homes = (
+        systems[systems["empire_owner"].notna()]
+        .rename_axis("node")
+        .reset_index()
+        .merge(
+            empire_df[["empire_id", "num_systems"]],
+            left_on="empire_owner",
+            right_on="empire_id",
+        )
+    )
+
+    owner = grow_territories(
+        hyperlanes,
+        rng,
+        homes=homes["node"].to_numpy(),
+        num_systems=homes["num_systems"].to_numpy(),
+    )
+    # home systems are already saved
+    owner[homes["node"].to_numpy()] = -1
+
     with get_session(engine) as session:
-        avaliable_ids = (
-            session.execute(
-                select(StarSystem.star_system_id).where(
-                    StarSystem.empire_owner == None
-                )
-            )
-            .scalars()
-            .all()
+        session.execute(
+            update(StarSystem),
+            pd.DataFrame(
+                {
+                    "star_system_id": systems["star_system_id"].to_numpy()[
+                        owner >= 0
+                    ],
+                    "empire_owner": homes["empire_id"].to_numpy()[
+                        owner[owner >= 0]
+                    ],
+                }
+            ).to_dict("records"),
         )
-        assigned_systems_order = rng.choice(
-            avaliable_ids, size=empire_df["num_systems"].sum(), replace=False
-        ).tolist()
-
-        start_id = 0
-        for empire_id, num_systems in empire_df[
-            ["empire_id", "num_systems"]
-        ].values:
-            end_id = start_id + num_systems
-            session.execute(
-                update(StarSystem)
-                .where(
-                    StarSystem.star_system_id.in_(
-                        assigned_systems_order[start_id:end_id]
-                    )
-                )
-                .values(empire_owner=int(empire_id))
-            )
-            start_id = end_id
 
 
 def assign_empire_star_systems(
     rng: np.random.Generator,
     *,
     engine: Engine,
+    ids: IdAllocator,
     num_stars: int,
     num_empires: int,
+    habitable_systems: np.ndarray,
+    hyperlanes: Hyperlanes,
 ):
-    assign_home_systems(engine, num_empires, rng)
+    assign_home_systems(
+        engine,
+        rng,
+        ids=ids,
+        num_empires=num_empires,
+        habitable_systems=habitable_systems,
+    )
 
     empires = add_empire_expansion_score(empires_info(engine), rng)
 
     empires = assign_num_systems(empires, rng, num_stars, num_empires)
 
-    update_empire_stars(engine, empires, rng)
+    update_empire_stars(engine, empires, rng, hyperlanes)
 
 
 __all__ = [
     "assign_empire_star_systems",
+    "get_habitable_systems",
 ]
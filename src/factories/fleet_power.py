@@ -0,0 +1,138 @@
+import colorful as cf
+from sqlalchemy import Engine, Select, func, select, update
+from sqlalchemy.orm import Session
+
+from src.database.db import get_session
+from src.models import (Empire, Fleet, ShipTemplate, ShipTemplateModule,
+                        Spaceship, SpaceshipModule, SpaceshipRank,
+                        add_fleet_power_triggers)
+
+# rollups are refreshed for a list (or subquery) of ids, or for every row
+# when the ids are None
+Ids = list[int] | Select | None
+
+
+def refresh_template_power(session: Session, template_ids: Ids = None):
+    """
+    Recalculates the power of ship templates after their modules change,
+    then the power of the fleets using them.
+    """
+    stmt = update(ShipTemplate).values(
+        ship_template_power=select(
+            func.coalesce(
+                func.sum(
+                    ShipTemplateModule.ship_module_count
+                    * SpaceshipModule.spaceship_module_power
+                ),
+                0,
+            )
+        )
+        .join(SpaceshipModule)
+        .where(
+            ShipTemplateModule.ship_template_id
+            == ShipTemplate.ship_template_id
+        )
+        .scalar_subquery()
+    )
+
+    if template_ids is not None:
+        stmt = stmt.where(ShipTemplate.ship_template_id.in_(template_ids))
+
+    session.execute(stmt.execution_options(synchronize_session=False))
+
+    fleet_ids = select(Spaceship.spaceship_fleet_id).distinct()
+    if template_ids is not None:
+        fleet_ids = fleet_ids.where(
+            Spaceship.spaceship_template_id.in_(template_ids)
+        )
+
+    refresh_fleet_power(session, fleet_ids)
+
+
+def refresh_fleet_power(session: Session, fleet_ids: Ids = None):
+    """
+    Recalculates the power of fleets after their ships change, then the
+    fleet power of the empires owning them.
+    """
+    stmt = update(Fleet).values(
+        fleet_power=select(
+            func.coalesce(
+                func.sum(
+                    ShipTemplate.ship_template_power
+                    * (1 + SpaceshipRank.spaceship_bonus_power)
+                ),
+                0,
+            )
+        )
+        .select_from(Spaceship)
+        .join(ShipTemplate)
+        .join(
+            SpaceshipRank,
+            Spaceship.spaceship_experience.between(
+                SpaceshipRank.spaceship_min_experience,
+                SpaceshipRank.spaceship_max_experience,
+            ),
+        )
+        .where(Spaceship.spaceship_fleet_id == Fleet.fleet_id)
+        .scalar_subquery()
+    )
+
+    if fleet_ids is not None:
+        stmt = stmt.where(Fleet.fleet_id.in_(fleet_ids))
+
+    session.execute(stmt.execution_options(synchronize_session=False))
+
+    empire_ids = None
+    if fleet_ids is not None:
+        empire_ids = (
+            select(Fleet.fleet_empire_owner)
+            .distinct()
+            .where(Fleet.fleet_id.in_(fleet_ids))
+        )
+
+    refresh_empire_fleet_power(session, empire_ids)
+
+
+def refresh_empire_fleet_power(session: Session, empire_ids: Ids = None):
+    """
+    Recalculates the fleet power of empires after their fleets change. The
+    empire score is adjusted by the change in fleet power.
+    """
+    fleet_power = (
+        select(func.coalesce(func.sum(Fleet.fleet_power), 0))
+        .where(Fleet.fleet_empire_owner == Empire.empire_id)
+        .scalar_subquery()
+    )
+
+    # MySQL assigns from left to right, the score must use the old power
+    stmt = update(Empire).ordered_values(
+        (
+            Empire.empire_score,
+            Empire.empire_score
+            - func.round(Empire.empire_fleet_power)
+            + func.round(fleet_power),
+        ),
+        (Empire.empire_fleet_power, fleet_power),
+    )
+
+    if empire_ids is not None:
+        stmt = stmt.where(Empire.empire_id.in_(empire_ids))
+
+    session.execute(stmt.execution_options(synchronize_session=False))
+
+
+def add_fleet_power(engine: Engine):
+    print(cf.yellow("Calculating fleet power..."))
+
+    with get_session(engine) as session:
+        refresh_fleet_power(session)
+
+    add_fleet_power_triggers(engine)
+
+
+__all__ = [
+    "add_fleet_power",
+    "refresh_template_power",
+    "refresh_fleet_power",
+    "refresh_empire_fleet_power",
+]
@@ -1,13 +1,14 @@
 import colorful as cf
 import numpy as np
 import pandas as pd
-from sqlalchemy import Engine, insert
+from sqlalchemy import Engine
 
-from src.database.db import get_session
+from src.database.writer import BackgroundWriter
 from src.models import Fleet
 from src.util import get_location
 
 from .utils.empires_util import empires_info
+from .utils.ids_util import IdAllocator
 from .utils.util import load_file
 
 
@@ -43,60 +44,73 @@ def calculate_num_fleets(df: pd.DataFrame):
     ) // 10
 
 
-def create_fleets(rng: np.random.Generator, engine: Engine):
+def create_fleets(
+    rng: np.random.Generator,
+    engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
+) -> pd.DataFrame:
+    """
+    Returns the fleets sorted by owner
+    """
     location = get_location()
     fleet_prefix = "assets/fleets_prefix.txt"
     fleet_suffix = "assets/fleets_suffix.txt"
 
     docked_percent = 70
 
-    min_fleets = empires_info(engine).total_fleets.min()
-
-    with get_session(engine) as session:
-        for _, empire in empires_info(engine).iterrows():
-            fleet_cloak_mu = 1 / (empire.total_fleets - min_fleets + 1) * 100
-
-            session.execute(
-                insert(Fleet),
-                [
-                    {
-                        "fleet_name": f"{prefix} {suffix}",
-                        "fleet_empire_owner": empire.empire_id,
-                        "fleet_is_docked": docked < docked_percent,
-                        # inversely proportional to the number of fleets
-                        "fleet_cloak_strength": int(fleet_cloak),
-                    }
-                    for prefix, suffix, docked, fleet_cloak in zip(
-                        rng.choice(
-                            load_file(
-                                location=location, filename=fleet_prefix
-                            ),
-                            size=empire.total_fleets,
-                        ),
-                        rng.choice(
-                            load_file(
-                                location=location, filename=fleet_suffix
-                            ),
-                            size=empire.total_fleets,
-                        ),
-                        rng.integers(0, 100, empire.total_fleets),
-                        rng.normal(
-                            fleet_cloak_mu,
-                            5,
-                            empire.total_fleets,
-                        ).clip(0, 100),
-                    )
-                ],
+    empires = empires_info(engine)
+    total_fleets = empires["total_fleets"].to_numpy()
+    num_fleets = total_fleets.sum()
+
+    # inversely proportional to the number of fleets
+    fleet_cloak_mu = 1 / (total_fleets - total_fleets.min() + 1) * 100
+
+    fleets = pd.DataFrame(
+        {
+            "fleet_id": ids.allocate(Fleet, num_fleets),
+            "fleet_name": pd.Series(
+                rng.choice(
+                    load_file(location=location, filename=fleet_prefix),
+                    size=num_fleets,
+                )
+            )
+            + " "
+            + rng.choice(
+                load_file(location=location, filename=fleet_suffix),
+                size=num_fleets,
+            ),
+            "fleet_empire_owner": np.repeat(
+                empires["empire_id"].to_numpy(), total_fleets
+            ),
+            "fleet_is_docked": rng.integers(0, 100, num_fleets)
+            < docked_percent,
+            "fleet_cloak_strength": rng.normal(
+                np.repeat(fleet_cloak_mu, total_fleets), 5
             )
+            .clip(0, 100)
+            .astype(int),
+        }
+    )
+
+    writer.write(Fleet, fleets)
+    writer.barrier()
+
+    return fleets[["fleet_id", "fleet_empire_owner"]]
 
 
-def add_fleets(rng: np.random.Generator, engine: Engine):
+def add_fleets(
+    rng: np.random.Generator,
+    engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
+):
     print(cf.yellow("Adding empire fleets"))
 
     empires = empires_info(engine)
     calculate_num_fleets(empires)
 
-    create_fleets(rng=rng, engine=engine)
+    return create_fleets(rng=rng, engine=engine, writer=writer, ids=ids)
 
 
 __all__ = ["add_fleets"]
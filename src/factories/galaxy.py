@@ -1,13 +1,18 @@
+import colorful as cf
 import numpy as np
 from faker import Faker
 from sqlalchemy import Engine
 
+from src.database.writer import BackgroundWriter
+from src.models import Crew, CrewFriend, Planet, Spaceship
 from src.settings import Settings
 
 from .crew import add_crew
 from .empire import create_empires
 from .empire_score import calculate_empire_score
-from .empire_star_systems import assign_empire_star_systems
+from .empire_star_systems import (assign_empire_star_systems,
+                                  get_habitable_systems)
+from .fleet_power import add_fleet_power
 from .fleets import add_fleets
 from .planet_resources import add_planet_pops
 from .planets import create_planets
@@ -15,6 +20,7 @@ from .ship_ranks import add_ship_ranks
 from .ship_templates import add_ship_templates
 from .ships import add_empire_ships
 from .stars import create_stars
+from .utils.ids_util import IdAllocator
 
 
 def generate_galaxy(
@@ -23,54 +29,103 @@ def generate_galaxy(
     engine: Engine,
     settings: Settings,
 ):
-    create_stars(
-        fake=fake,
-        rng=rng,
-        engine=engine,
-        num_stars=settings.num_stars,
-    )
-    create_planets(
-        rng=rng,
-        engine=engine,
-    )
-    create_empires(
-        fake=fake,
-        rng=rng,
-        num_empires=settings.number_of_empires,
-        engine=engine,
-    )
-    assign_empire_star_systems(
-        rng=rng,
-        engine=engine,
-        num_empires=settings.number_of_empires,
-        num_stars=settings.num_stars,
-    )
-    add_planet_pops(
-        rng=rng,
-        engine=engine,
-    )
-    add_fleets(
-        rng=rng,
-        engine=engine,
-    )
-    add_ship_ranks(
-        engine=engine,
-    )
-    add_ship_templates(
-        fake=fake,
-        rng=rng,
-        engine=engine,
-    )
-    add_empire_ships(
-        rng=rng,
+    ids = IdAllocator(engine)
+
+    # the large tables are written on a background thread while the next
+    # rows are generated, and loaded over several connections on server
+    # databases
+    with BackgroundWriter(
+        engine,
+        parallel_models=(Planet, Spaceship, Crew, CrewFriend),
+        num_connections=settings.num_load_connections,
+    ) as writer:
+        stars, hyperlanes = create_stars(
+            fake=fake,
+            rng=rng,
+            engine=engine,
+            ids=ids,
+            writer=writer,
+            num_stars=settings.num_stars,
+        )
+        create_planets(
+            rng=rng,
+            engine=engine,
+            ids=ids,
+            writer=writer,
+            stars=stars,
+        )
+        # only create the empires that can get a habitable home system
+        habitable_systems = get_habitable_systems(engine)
+        num_empires = min(settings.number_of_empires, len(habitable_systems))
+
+        if num_empires < settings.number_of_empires:
+            print(
+                cf.orange(
+                    f"Only {len(habitable_systems)} habitable star systems. "
+                    f"Creating {num_empires} empires instead of "
+                    f"{settings.number_of_empires}"
+                )
+            )
+
+        create_empires(
+            fake=fake,
+            rng=rng,
+            num_empires=num_empires,
+            engine=engine,
+            ids=ids,
+        )
+        assign_empire_star_systems(
+            rng=rng,
+            engine=engine,
+            ids=ids,
+            num_empires=num_empires,
+            num_stars=settings.num_stars,
+            habitable_systems=habitable_systems,
+            hyperlanes=hyperlanes,
+        )
+        add_planet_pops(
+            rng=rng,
+            engine=engine,
+        )
+        fleets = add_fleets(
+            rng=rng,
+            engine=engine,
+            writer=writer,
+            ids=ids,
+        )
+        add_ship_ranks(
+            engine=engine,
+        )
+        templates_power = add_ship_templates(
+            fake=fake,
+            rng=rng,
+            engine=engine,
+        )
+        ships = add_empire_ships(
+            rng=rng,
+            engine=engine,
+            ids=ids,
+            writer=writer,
+            fleets=fleets,
+        )
+        add_fleet_power(
+            engine=engine,
+        )
+        add_crew(
+            rng=rng,
+            engine=engine,
+            ids=ids,
+            writer=writer,
+            ships=ships,
+        )
+    calculate_empire_score(
         engine=engine,
-    )
-    add_crew(
-        fake=fake,
         rng=rng,
-        engine=engine,
+        ships=ships,
+        templates_power=templates_power,
     )
-    calculate_empire_score(engine=engine, rng=rng)
+
+    ids.reset_sequences()
 
 
 __all__ = ["generate_galaxy"]
@@ -1,10 +1,8 @@
-import math
-
 import colorful as cf
 import numpy as np
 import pandas as pd
-from sqlalchemy import Engine, func, select
-from sqlalchemy.orm import Session
+from sqlalchemy import (Engine, Float, Integer, bindparam, cast, func, select,
+                        update)
 
 from src.database.db import get_session
 from src.models import Biome, Planet, StarSystem
@@ -34,14 +32,14 @@ def add_auth_rank(df: pd.DataFrame, *, rng: np.random.Generator):
 
 def get_habitable_planets_pops(
     engine: Engine,
-    empire: pd.Series,
+    empires: pd.DataFrame,
     rng: np.random.Generator,
     *,
     m: float,
     b: float,
     scale: float,
 ):
-    # get the habitable planets for this empire
+    # get the habitable planets of every empire
     habitable_planets = pd.read_sql(
         select(
             Planet.planet_id,
@@ -50,24 +48,34 @@ def get_habitable_planets_pops(
             Planet.planet_minerals_value,
             Planet.planet_research_value,
             Planet.planet_trade_value,
+            StarSystem.empire_owner.label("empire_id"),
         )
         .join(StarSystem)
         .join(Biome)
         .where(Biome.biome_is_habitable == True)
-        .where(StarSystem.empire_owner == empire.empire_id),
+        .where(StarSystem.empire_owner != None)
+        .order_by(Planet.planet_id),
         engine,
     )
 
+    # broadcast each empire's government efficiency to its planets
+    habitable_planets = habitable_planets.merge(
+        empires[["empire_id", "gov_efficiency_bonus", "gov_efficiency"]],
+        on="empire_id",
+    )
+
     habitable_planets["planet_pops"] = (
         (habitable_planets["planet_size"] * m + b)
-        + empire.gov_efficiency_bonus * scale
+        + habitable_planets["gov_efficiency_bonus"] * scale
         + rng.normal(0, scale, len(habitable_planets))
     ).astype(int)
 
     return habitable_planets
 
 
-def add_habitable_planet_resources(df: pd.DataFrame, efficiency: float):
+def add_habitable_planet_resources(
+    df: pd.DataFrame, efficiency: float | pd.Series
+):
     # resources intrinsic to the planet
     df["planet_energy_value"] = (
         (df["planet_energy_value"] + 1) * df["planet_pops"] * 5 * efficiency
@@ -107,28 +115,32 @@ def add_planet_pops(rng: np.random.Generator, *, engine: Engine):
 
     scale = 2.5
 
-    # loop through each empire's habitable planets
-    # (w 100K stars only about 50 planets max) so no pagination needed
-    for _, empire in empires.iterrows():
-        habitable_planets = get_habitable_planets_pops(
-            engine, empire, rng, m=m, b=b, scale=scale
-        )
-
-        habitable_planets = add_habitable_planet_resources(
-            habitable_planets, empire.gov_efficiency
-        )
+    habitable_planets = get_habitable_planets_pops(
+        engine, empires, rng, m=m, b=b, scale=scale
+    )
 
-        # update the planets
-        with get_session(engine) as session:
-            session.bulk_update_mappings(
-                Planet,
-                habitable_planets.to_dict(orient="records"),
-            )
+    habitable_planets = add_habitable_planet_resources(
+        habitable_planets, habitable_planets["gov_efficiency"]
+    )
 
-        print(
-            f"Added planet pops for empire {empire.empire_id} / {len(empires)}"
+    # update the planets of all empires at once
+    with get_session(engine) as session:
+        session.execute(
+            update(Planet),
+            habitable_planets[
+                [
+                    "planet_id",
+                    "planet_pops",
+                    "planet_energy_value",
+                    "planet_minerals_value",
+                    "planet_research_value",
+                    "planet_trade_value",
+                ]
+            ].to_dict(orient="records"),
         )
 
+    print(f"Added planet pops for {len(empires)} empires")
+
     rescale_resources(engine)
     add_empire_resources(empires_info(engine), engine)
 
@@ -149,52 +161,54 @@ def add_empire_resources(df: pd.DataFrame, engine: Engine):
     df["total_trade"] = empire_resources["total_trade"]
 
 
-_page_size = 1000
-
-
-def chokepoint_planets(session: Session, page: int):
-    return session.scalars(
-        select(Planet)
-        .join(StarSystem)
-        .where(StarSystem.system_is_choke_point == True)
-        .order_by(Planet.planet_id.desc())
-        .offset(page * _page_size)
-        .limit(_page_size)
-    ).all()
+def _truncate(expr, engine: Engine):
+    """
+    Truncates a float expression to an integer (like python's int()).
+    CAST rounds on everything except SQLite.
+    """
+    if engine.dialect.name != "sqlite":
+        expr = func.floor(expr)
 
-
-def num_chokepoint_planets(engine: Engine):
-    with get_session(engine) as session:
-        return session.scalar(
-            select(func.count(Planet.planet_id))
-            .join(StarSystem)
-            .where(StarSystem.system_is_choke_point == True)
-        )
+    return cast(expr, Integer)
 
 
 def rescale_resources(engine: Engine):
     print(cf.yellow("Rescaling planet resources"))
 
-    # multiply 1.1 to people resources for chokepoint planets
-    num_pages = math.ceil(num_chokepoint_planets(engine) / _page_size)
-
-    for page in range(num_pages):
-        print(f"Rescaling page {page + 1}/{num_pages}")
+    multiplier = bindparam(
+        "chokepoint_multiplier",
+        get_settings().chokepoint_multiplier,
+        type_=Float,
+    )
 
-        with get_session(engine) as session:
-            planets = chokepoint_planets(session, page)
+    # multiply people resources for chokepoint planets
+    stmt = update(Planet).values(
+        planet_research_value=_truncate(
+            Planet.planet_research_value * multiplier, engine
+        ),
+        planet_trade_value=_truncate(
+            Planet.planet_trade_value * multiplier, engine
+        ),
+    )
 
-            for planet in planets:
-                planet.planet_research_value = int(
-                    planet.planet_research_value
-                    * get_settings().chokepoint_multiplier
-                )
-                planet.planet_trade_value = int(
-                    planet.planet_trade_value
-                    * get_settings().chokepoint_multiplier
+    if engine.dialect.name == "postgresql":
+        # UPDATE planet ... FROM star_system
+        stmt = stmt.where(
+            Planet.planet_star_system == StarSystem.star_system_id
+        ).where(StarSystem.system_is_choke_point == True)
+    else:
+        stmt = stmt.where(
+            Planet.planet_star_system.in_(
+                select(StarSystem.star_system_id).where(
+                    StarSystem.system_is_choke_point == True
                 )
+            )
+        )
 
-            session.add_all(planets)
+    with get_session(engine) as session:
+        session.execute(
+            stmt.execution_options(synchronize_session=False),
+        )
 
 
 __all__ = ["add_planet_pops"]
@@ -4,16 +4,17 @@ from functools import lru_cache
 import colorful as cf
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
-from sqlalchemy import Engine, insert, select
+from sqlalchemy import Engine, insert, update
 
 from src.database.db import get_session
-from src.models import Biome, Planet, StarSystem
+from src.database.writer import BackgroundWriter
+from src.models import Biome, Planet
 from src.settings import get_settings
 from src.util import MAX_NUM_STARS, MIN_NUM_STARS, get_m_and_b, get_yhat
 
 from .utils.celestial_bodies_util import (biomes_df, load_star_config,
                                           stars_type_df)
+from .utils.ids_util import IdAllocator
 from .utils.util import MAX_PLANET_SIZE, MIN_PLANET_SIZE
 
 
@@ -29,56 +30,45 @@ def create_planets(
     *,
     rng: np.random.Generator,
     engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
+    stars: pd.DataFrame,
 ):
     print(cf.yellow("Generating planets..."))
 
     add_biomes(engine)
 
-    scaler = MinMaxScaler(feature_range=(MIN_PLANET_SIZE, MAX_PLANET_SIZE))
+    size_tables = {
+        star_type_id: planet_size_table(rng, star_type_habitability)
+        for star_type_id, star_type_habitability in stars_type_df()[
+            "star_type_habitability"
+        ].items()
+    }
 
     stars_type_df().apply(
-        add_planets, axis=1, engine=engine, rng=rng, scaler=scaler
+        add_planets,
+        axis=1,
+        writer=writer,
+        ids=ids,
+        rng=rng,
+        size_tables=size_tables,
+        stars=stars,
     )
+    writer.barrier()
 
-    add_structures(engine, rng, target="special")
-    add_structures(engine, rng, target="megastructure")
+    add_structures(engine, rng, ids=ids, target="special")
+    add_structures(engine, rng, ids=ids, target="megastructure")
 
 
-def get_num_stars_by_type(type_id: int, engine: Engine):
-    with get_session(engine) as session:
-        return (
-            session.query(StarSystem)
-            .filter(StarSystem.star_type_id == type_id)
-            .count()
-        )
+# number of draws used to build each planet size sampling table
+_size_table_samples = 2**16
 
 
-def get_stars_by_page(
-    engine: Engine, *, type_id: int, page: int, page_size: int
-):
+def planet_size_table(rng: np.random.Generator, habitability_score: float):
     """
-    Returns a list of star ids for a given star type id and page number
-    """
-    with get_session(engine) as session:
-        return (
-            session.query(
-                StarSystem.star_system_id, StarSystem.star_system_name
-            )
-            .filter(StarSystem.star_type_id == type_id)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
-        )
-
-
-def get_planet_sizes(
-    scaler: MinMaxScaler,
-    rng: np.random.Generator,
-    num_planets: int,
-    habitability_score: float,
-):
-    """
-    Generates planets sizes
+    Builds the inverse-CDF sampling table of planet sizes for a star type.
+    Returns the cumulative weight of each size from MIN_PLANET_SIZE to
+    MAX_PLANET_SIZE.
     """
     rock_mu = 1 + rng.uniform(-0.5, 0.5)
     sigma = 0.5 + rng.uniform(0, 0.25, size=2)
@@ -91,25 +81,47 @@ def get_planet_sizes(
 
     gas_mult = max(int((gas + large_rock) / rock + rng.uniform(-5, 5)), 0)
 
-    n_sample_per_dist = math.ceil(num_planets / (1 + gas_mult))
+    rocky_planets = rng.normal(
+        loc=rock_mu, scale=sigma[0], size=_size_table_samples
+    )
+    gas_planets = rng.normal(
+        loc=rock_mu + sep, scale=sigma[1], size=_size_table_samples
+    )
 
-    return scaler.fit_transform(
-        np.concatenate(
-            (
-                rng.normal(
-                    loc=rock_mu, scale=sigma[0], size=n_sample_per_dist
-                ),
-                np.repeat(
-                    rng.normal(
-                        loc=rock_mu + sep,
-                        scale=sigma[1],
-                        size=n_sample_per_dist,
-                    ),
-                    gas_mult,
-                ),
-            )
-        ).reshape(-1, 1)
-    ).astype(int)[:num_planets]
+    # min max scale the mixture to the planet sizes
+    low = min(rocky_planets.min(), gas_planets.min())
+    high = max(rocky_planets.max(), gas_planets.max())
+
+    def size_counts(sample: np.ndarray):
+        sizes = (
+            (sample - low) / (high - low) * (MAX_PLANET_SIZE - MIN_PLANET_SIZE)
+        ).astype(int)
+
+        return np.bincount(
+            sizes, minlength=MAX_PLANET_SIZE - MIN_PLANET_SIZE + 1
+        )
+
+    return np.cumsum(
+        size_counts(rocky_planets) + size_counts(gas_planets) * gas_mult
+    )
+
+
+def get_planet_sizes(
+    size_table: np.ndarray,
+    rng: np.random.Generator,
+    num_planets: int,
+):
+    """
+    Generates planets sizes from a star type's sampling table
+    """
+    return (
+        np.searchsorted(
+            size_table,
+            rng.integers(size_table[-1], size=num_planets),
+            side="right",
+        )
+        + MIN_PLANET_SIZE
+    )
 
 
 def apply_planet_name(df: pd.DataFrame):
@@ -123,18 +135,16 @@ def apply_planet_name(df: pd.DataFrame):
 def make_planet_df(
     *,
     rng: np.random.Generator,
-    scaler: MinMaxScaler,
+    size_table: np.ndarray,
     num_planets: int,
-    stars_ids: list[int],
+    stars_ids: np.ndarray,
     star_habitability: float,
 ):
     planets_df = pd.DataFrame(
         np.concatenate(
             (
                 rng.choice(stars_ids, size=num_planets, replace=True),
-                get_planet_sizes(
-                    scaler, rng, num_planets, star_habitability
-                ).reshape(-1, 1),
+                get_planet_sizes(size_table, rng, num_planets).reshape(-1, 1),
             ),
             axis=1,
         ),
@@ -189,61 +199,65 @@ def get_one_hot_biome_materials(
     df: pd.DataFrame,
     rng: np.random.Generator,
     *,
-    one_hot: bool,
     material_to_col: dict,
 ):
+    """
+    One hot encodes a random material of the biome for every planet. Use
+    biome_materials_mask for all the materials of the biome.
+    """
     biome = biomes_df().loc[df.name]
 
     col_to_material = {v: k for k, v in material_to_col.items()}
 
-    if one_hot:
-        one_hot_materials = np.eye(len(material_to_col))[
-            np.vectorize(col_to_material.get)(
-                rng.choice(
-                    [mat for mat in biome["biome_materials"]],
-                    size=len(df),
-                    replace=True,
-                )
-            )
-        ]
-    else:
-        # if not one hot, use all materials in the biome
-        one_hot_materials = np.zeros((len(material_to_col),))
-        one_hot_materials[
-            np.vectorize(col_to_material.get)(
-                biome["biome_materials"].tolist()
+    return np.eye(len(material_to_col))[
+        np.vectorize(col_to_material.get)(
+            rng.choice(
+                [mat for mat in biome["biome_materials"]],
+                size=len(df),
+                replace=True,
             )
-        ] = 1
-        # repeat for all planets
-        one_hot_materials = np.repeat(
-            one_hot_materials.reshape(1, -1), len(df), axis=0
         )
+    ]
+
+
+# minerals, energy, research, trade_value
+_resource_mus = [2, 1.5, 0, 5]
+_resource_sigmas = [3, 2, 2, 5]
+_material_to_col = {
+    0: "planet_minerals_value",
+    1: "planet_energy_value",
+    2: "planet_research_value",
+    3: "planet_trade_value",
+}
+
 
-    return one_hot_materials
+@lru_cache()
+def biome_materials_mask() -> pd.DataFrame:
+    """
+    1 if the biome (index) can have the material (column), else 0
+    """
+    return pd.DataFrame(
+        [
+            [int(col in materials) for col in _material_to_col.values()]
+            for materials in biomes_df()["biome_materials"]
+        ],
+        index=biomes_df().index,
+        columns=list(_material_to_col.values()),
+    )
 
 
 def add_biome_resources(
-    df: pd.DataFrame, rng: np.random.Generator, *, one_hot=True, min_value=0
+    df: pd.DataFrame, rng: np.random.Generator, *, min_value=0
 ):
-    # minerals, energy, research, trade_value
-    mus = [2, 1.5, 0, 5]
-    sigmas = [3, 2, 2, 5]
-
     materials = (
         rng.normal(
-            loc=mus,
-            scale=sigmas,
-            size=(len(df), len(mus)),
+            loc=_resource_mus,
+            scale=_resource_sigmas,
+            size=(len(df), len(_resource_mus)),
         )
         .clip(min_value)
         .astype(int)
     )
-    material_to_col = {
-        0: "planet_minerals_value",
-        1: "planet_energy_value",
-        2: "planet_research_value",
-        3: "planet_trade_value",
-    }
 
     choices = (
         materials
@@ -251,12 +265,11 @@ def add_biome_resources(
         * get_one_hot_biome_materials(
             df=df,
             rng=rng,
-            one_hot=one_hot,
-            material_to_col=material_to_col,
+            material_to_col=_material_to_col,
         )
     )
 
-    for i, col in enumerate(material_to_col.values()):
+    for i, col in enumerate(_material_to_col.values()):
         df[col] = choices[:, i]
 
     return df
@@ -264,21 +277,24 @@ def add_biome_resources(
 
 def add_planets(
     row: pd.Series,
-    engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
     rng: np.random.Generator,
-    scaler: MinMaxScaler,
+    size_tables: dict[int, np.ndarray],
+    stars: pd.DataFrame,
 ):
     star_id = int(row.name)
-    num_stars_with_id = get_num_stars_by_type(star_id, engine)
+    stars_with_id = stars.loc[
+        stars["star_type_id"] == star_id,
+        ["star_system_id", "star_system_name"],
+    ].to_numpy()
 
     page_size = 1000
 
-    for page in range((num_stars_with_id // page_size) + 1):
+    for page in range((len(stars_with_id) // page_size) + 1):
         print(f"Generating planets for star type {star_id} ...")
 
-        stars_ids = get_stars_by_page(
-            engine, type_id=star_id, page=page, page_size=page_size
-        )
+        stars_ids = stars_with_id[page * page_size : (page + 1) * page_size]
 
         num_planets = int(len(stars_ids) * row["mean_celestial_bodies"])
 
@@ -287,17 +303,14 @@ def add_planets(
 
         planets_df = make_planet_df(
             rng=rng,
-            scaler=scaler,
+            size_table=size_tables[star_id],
             num_planets=num_planets,
             stars_ids=stars_ids,
             star_habitability=row["star_type_habitability"],
         )
+        planets_df["planet_id"] = ids.allocate(Planet, len(planets_df))
 
-        with get_session(engine) as session:
-            session.execute(
-                insert(Planet),
-                planets_df.to_dict("records"),
-            )
+        writer.write(Planet, planets_df)
 
 
 @lru_cache()
@@ -326,11 +339,17 @@ def get_structures_to_add(target: str):
     return mega * multiplier
 
 
-def add_structures(engine: Engine, rng: np.random.Generator, *, target: str):
+def add_structures(
+    engine: Engine,
+    rng: np.random.Generator,
+    *,
+    ids: IdAllocator,
+    target: str,
+):
     """
     Post planet generation, add special planet types
     """
-    mega = get_structures_to_add(target=target)
+    mega = pd.DataFrame(get_structures_to_add(target=target))
 
     if len(mega) == 0:
         return
@@ -339,64 +358,55 @@ def add_structures(engine: Engine, rng: np.random.Generator, *, target: str):
 
     with get_session(engine) as session:
         # select random planets to turn into special planets
-        num_planets = session.query(Planet).count()
+        selected_ids = rng.choice(
+            ids.ids(Planet),
+            size=len(mega),
+            replace=False,
+        )
 
-        selected_ids = (
-            rng.choice(
-                num_planets,
-                size=len(mega),
-                replace=False,
-            )
-            + 1
-        ).tolist()
+        resources = special_biome_resources(
+            rng,
+            biomes=mega["biome"].to_numpy(),
+            sizes=mega["size"].to_numpy(),
+        )
+        resources["planet_id"] = selected_ids
+        resources["planet_biome"] = mega["biome"]
+        resources["planet_size"] = mega["size"]
 
-        planets = session.scalars(
-            select(Planet).where(Planet.planet_id.in_(selected_ids))
-        ).all()
+        session.execute(
+            update(Planet),
+            resources.astype(int).to_dict("records"),
+        )
 
-        for planet, mega_info in zip(planets, mega):
-            # add resources to special planets
-            resources = add_biome_resources(
-                pd.DataFrame(
-                    {
-                        "name": [mega_info["biome"]],
-                    }
-                ),
-                rng,
-                one_hot=False,
-                min_value=1,
-            ).set_index("name")
-
-            resources = scale_resources(resources, mega_info["size"], rng)
-
-            planet.planet_biome = mega_info["biome"]
-            planet.planet_size = mega_info["size"]
-            assign_resource(
-                planet,
-                resources,
-                "planet_minerals_value",
-            )
-            assign_resource(
-                planet,
-                resources,
-                "planet_energy_value",
-            )
-            assign_resource(planet, resources, "planet_research_value")
-            assign_resource(planet, resources, "planet_trade_value")
 
+def special_biome_resources(
+    rng: np.random.Generator, *, biomes: np.ndarray, sizes: np.ndarray
+) -> pd.DataFrame:
+    """
+    Generates the resources of special planets. Unlike regular planets,
+    special planets have every material of their biome and are scaled up
+    by their size.
+    """
+    materials = (
+        rng.normal(
+            loc=_resource_mus,
+            scale=_resource_sigmas,
+            size=(len(biomes), len(_resource_mus)),
+        )
+        .clip(1)
+        .astype(int)
+        * biome_materials_mask().loc[biomes].to_numpy()
+    )
 
-def scale_resources(
-    resources: pd.DataFrame, planet_size: int, rng: np.random.Generator
-):
     mu = get_yhat(
-        planet_size, *get_m_and_b(MIN_PLANET_SIZE, 1.5, MAX_PLANET_SIZE, 5)
+        sizes, *get_m_and_b(MIN_PLANET_SIZE, 1.5, MAX_PLANET_SIZE, 5)
     )
-    multiplier = max(rng.normal(mu, 0.5), 1)
-    return resources.multiply(multiplier).astype(int)
+    multiplier = np.maximum(rng.normal(mu, 0.5), 1)
 
-
-def assign_resource(planet: Planet, resources: pd.DataFrame, resource: str):
-    setattr(planet, resource, int(resources[resource].values[0]))
+    return pd.DataFrame(
+        (materials * multiplier.reshape(-1, 1)).astype(int),
+        columns=list(_material_to_col.values()),
+    )
 
 
 __all__ = ["create_planets"]
@@ -63,22 +63,59 @@ def ship_templates_df(fake: Faker):
 
 def add_ship_templates(
     *, rng: np.random.Generator, fake: Faker, engine: Engine
-):
+) -> pd.Series:
+    """
+    Returns the power of every ship template
+    """
     add_ship_classes(engine)
     add_ship_mods(engine)
-    insert_ship_templates(engine, fake)
-    add_ship_template_mods(engine, fake)
+
+    template_modules = create_template_mods(fake)
+
+    templates_power = insert_ship_templates(engine, fake, template_modules)
+    add_ship_template_mods(engine, template_modules)
+
+    return templates_power
+
+
+def calculate_template_power(template_modules: list[dict]) -> pd.Series:
+    """
+    Sum of the power of every module in each ship template
+    """
+    df = pd.DataFrame(template_modules)
+
+    return (
+        (
+            df["ship_module_count"]
+            * ship_modules()
+            .loc[df["ship_module_id"], "spaceship_module_power"]
+            .to_numpy()
+        )
+        .groupby(df["ship_template_id"])
+        .sum()
+    )
 
 
-def insert_ship_templates(engine: Engine, fake: Faker):
+def insert_ship_templates(
+    engine: Engine, fake: Faker, template_modules: list[dict]
+) -> pd.Series:
     print(cf.yellow("Adding ship templates"))
 
+    templates = ship_templates_df(fake).copy()
+    templates["ship_template_power"] = (
+        calculate_template_power(template_modules)
+        .reindex(templates.index, fill_value=0)
+        .astype(int)
+    )
+
     with get_session(engine) as session:
         session.execute(
             insert(ShipTemplate),
-            ship_templates_df(fake).reset_index().to_dict("records"),
+            templates.reset_index().to_dict("records"),
         )
 
+    return templates["ship_template_power"]
+
 
 def add_ship_classes(engine: Engine):
     print(cf.yellow("Adding ship classes"))
@@ -99,9 +136,7 @@ def add_ship_mods(engine: Engine):
         )
 
 
-def add_ship_template_mods(engine: Engine, fake: Faker):
-    print(cf.yellow("Adding ship template modules"))
-
+def create_template_mods(fake: Faker) -> list[dict]:
     template_modules = []
 
     for _, template in ship_templates_df(fake).iterrows():
@@ -121,6 +156,12 @@ def add_ship_template_mods(engine: Engine, fake: Faker):
                 )
             )
 
+    return template_modules
+
+
+def add_ship_template_mods(engine: Engine, template_modules: list[dict]):
+    print(cf.yellow("Adding ship template modules"))
+
     with get_session(engine) as session:
         session.execute(
             insert(ShipTemplateModule),
@@ -1,18 +1,29 @@
 import colorful as cf
 import numpy as np
 import pandas as pd
-from sqlalchemy import Engine, insert, select
+from sqlalchemy import Engine, select
 
-from src.database.db import get_session
-from src.models import Fleet, ShipClass, ShipTemplate, Spaceship
+from src.database.writer import BackgroundWriter
+from src.models import ShipClass, ShipTemplate, Spaceship
 from src.util import get_location
 
+from .utils.ids_util import IdAllocator
 from .utils.ships_empire_util import empire_fleet_info
 from .utils.ships_util import ship_class_df
 from .utils.util import load_file
 
 
-def add_empire_ships(rng: np.random.Generator, *, engine: Engine):
+def add_empire_ships(
+    rng: np.random.Generator,
+    *,
+    engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
+    fleets: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Returns the ships with their empire, template, experience and crew size
+    """
     empire_fleets = empire_fleet_info(engine, rng)
 
     print(
@@ -21,86 +32,156 @@ def add_empire_ships(rng: np.random.Generator, *, engine: Engine):
         )
     )
 
-    for ship_class in ship_class_df()["ship_class_name"].unique():
-        print(f"Adding {ship_class} ships to empires")
-        for (_, empire), template in zip(
-            empire_fleets.iterrows(),
+    ships = generate_ships(
+        empire_fleets,
+        fleets=fleets,
+        templates=get_templates(engine),
+        rng=rng,
+    )
+    ships["spaceship_id"] = ids.allocate(Spaceship, len(ships))
+
+    writer.write(Spaceship, ships)
+    writer.barrier()
+
+    return ships[
+        [
+            "spaceship_id",
+            "empire_id",
+            "spaceship_template_id",
+            "spaceship_experience",
+            "ship_crew",
+        ]
+    ]
+
+
+def get_templates(engine: Engine) -> pd.DataFrame:
+    return pd.read_sql(
+        select(ShipTemplate.ship_template_id, ShipClass.ship_class_name).join(
+            ShipClass
+        ),
+        engine,
+    )
+
+
+def generate_ships(
+    empire_fleets: pd.DataFrame,
+    *,
+    fleets: pd.DataFrame,
+    templates: pd.DataFrame,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    """
+    Generates every ship of every empire. Each empire uses one random
+    template per ship class and every ship joins a random fleet of its
+    empire that is not full.
+    """
+    ship_classes = ship_class_df()["ship_class_name"].unique()
+
+    # (ship class, empire) matrices
+    num_ships = (
+        empire_fleets[[f"num_{ship_class}" for ship_class in ship_classes]]
+        .to_numpy(dtype=int)
+        .T.clip(0)
+    )
+    class_templates = np.stack(
+        [
             rng.choice(
-                get_templates_by_class_type(engine, ship_class=ship_class)[
-                    "ship_template_id"
+                templates.loc[
+                    templates["ship_class_name"] == ship_class,
+                    "ship_template_id",
                 ],
-                replace=True,
                 size=len(empire_fleets),
-            ),
-        ):
-            add_ships(
-                empire,
-                ship_class=ship_class,
-                template=template,
-                rng=rng,
-                engine=engine,
             )
+            for ship_class in ship_classes
+        ]
+    )
 
+    ship_empire = np.repeat(
+        np.tile(np.arange(len(empire_fleets)), len(ship_classes)),
+        num_ships.ravel(),
+    )
+    total_ships = len(ship_empire)
 
-def get_fleets_by_empire_id(engine: Engine, *, empire_id: int):
-    return pd.read_sql(
-        select(Fleet.fleet_id).where(Fleet.fleet_empire_owner == empire_id),
-        engine,
+    # CSR index from empire to its fleets, fleets are sorted by empire
+    fleet_owners = fleets["fleet_empire_owner"].to_numpy()
+    empire_ids = empire_fleets["empire_id"].to_numpy()
+    fleets_start = np.searchsorted(fleet_owners, empire_ids, side="left")
+    fleets_count = (
+        np.searchsorted(fleet_owners, empire_ids, side="right") - fleets_start
     )
 
+    fleet = assign_fleets(
+        ship_empire,
+        fleets_start=fleets_start,
+        fleets_count=fleets_count,
+        max_fleet_size=empire_fleets["max_fleet_size"].to_numpy(dtype=int),
+        rng=rng,
+    )
 
-def get_templates_by_class_type(engine: Engine, *, ship_class: str):
-    return pd.read_sql(
-        select(ShipTemplate.ship_template_id, ShipTemplate.ship_template_name)
-        .join(ShipClass)
-        .where(ShipClass.ship_class_name == ship_class),
-        engine,
+    suffix = rng.choice(
+        load_file(get_location(), "./assets/ship_suffix.txt"),
+        size=total_ships,
+    )
+
+    return pd.DataFrame(
+        {
+            "spaceship_name": pd.Series(
+                empire_fleets["empire_ship_prefix"].to_numpy()[ship_empire]
+            )
+            + " "
+            + suffix,
+            "spaceship_fleet_id": fleets["fleet_id"].to_numpy()[fleet],
+            "spaceship_template_id": np.repeat(
+                class_templates.ravel(), num_ships.ravel()
+            ),
+            "spaceship_experience": rng.integers(
+                0,
+                empire_fleets["command_limit"].to_numpy()[ship_empire] + 1,
+            ),
+            "empire_id": empire_ids[ship_empire],
+            "ship_crew": np.repeat(
+                np.repeat(
+                    ship_class_df()["ship_crew"].to_numpy(), len(empire_fleets)
+                ),
+                num_ships.ravel(),
+            ),
+        }
     )
 
 
-def add_ships(
-    empire: pd.Series,
+def assign_fleets(
+    ship_empire: np.ndarray,
     *,
-    ship_class: str,
-    template: int,
+    fleets_start: np.ndarray,
+    fleets_count: np.ndarray,
+    max_fleet_size: np.ndarray,
     rng: np.random.Generator,
-    engine: Engine,
-):
-    num_ships = empire[f"num_{ship_class}"]
-
-    if num_ships <= 0:
-        return
-
-    ship_suffix_file = "./assets/ship_suffix.txt"
-
-    with get_session(engine) as session:
-        session.execute(
-            insert(Spaceship).values(
-                [
-                    {
-                        "spaceship_name": f"{empire['empire_ship_prefix']} "
-                        f"{suffix}",
-                        "spaceship_fleet_id": int(fleet),
-                        "spaceship_template_id": int(template),
-                        "spaceship_experience": int(xp),
-                    }
-                    for fleet, suffix, xp in zip(
-                        rng.choice(
-                            get_fleets_by_empire_id(
-                                engine, empire_id=int(empire["empire_id"])
-                            )["fleet_id"],
-                            size=num_ships,
-                            replace=True,
-                        ),
-                        rng.choice(
-                            load_file(get_location(), ship_suffix_file),
-                            size=num_ships,
-                            replace=True,
-                        ),
-                        rng.integers(
-                            0, empire["command_limit"] + 1, size=num_ships
-                        ),
-                    )
-                ]
-            )
-        )
+) -> np.ndarray:
+    """
+    Assigns every ship to a random free slot in the fleets of its empire,
+    each fleet has max_fleet_size slots. Ships of empires without enough
+    slots are spread over the full fleets again.
+
+    Returns the position (in the fleets sorted by empire) of the fleet of
+    each ship.
+    """
+    capacity = fleets_count * max_fleet_size
+    first_slot = np.cumsum(capacity) - capacity
+
+    # the slots of every empire in random order
+    slot_empire = np.repeat(np.arange(len(capacity)), capacity)
+    slots = np.lexsort((rng.random(len(slot_empire)), slot_empire))
+
+    # rank of every ship within its empire
+    order = np.argsort(ship_empire, kind="stable")
+    rank = np.empty(len(ship_empire), dtype=int)
+    rank[order] = np.arange(len(order)) - np.searchsorted(
+        ship_empire[order], ship_empire[order]
+    )
+
+    slot = (
+        slots[first_slot[ship_empire] + rank % capacity[ship_empire]]
+        - first_slot[ship_empire]
+    )
+
+    return fleets_start[ship_empire] + slot // max_fleet_size[ship_empire]
@@ -1,18 +1,20 @@
 import math
 
 import colorful as cf
-import networkx as nx
 import numpy as np
+import pandas as pd
 from faker import Faker
 from sqlalchemy import Engine, insert
 
 from src.database.db import get_session
+from src.database.writer import BackgroundWriter
 from src.models.star_system import StarSystem, StarType
 from src.settings import get_settings
-from src.util import (MAX_NUM_STARS, MIN_NUM_STARS, get_location, get_m_and_b,
-                      get_yhat)
+from src.util import get_location
 
 from .utils.celestial_bodies_util import stars_type_df
+from .utils.hyperlanes_util import Hyperlanes, generate_hyperlanes
+from .utils.ids_util import IdAllocator
 from .utils.util import load_file
 
 
@@ -38,8 +40,14 @@ def create_stars(
     fake: Faker,
     rng: np.random.Generator,
     engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
     num_stars: int,
-):
+) -> tuple[pd.DataFrame, Hyperlanes]:
+    """
+    Returns the stars and the hyperlane map between them. Node i of the map
+    is the i-th star.
+    """
     print(cf.yellow("Generating stars..."))
 
     create_star_types(engine)
@@ -53,148 +61,78 @@ def create_stars(
     page_size = len(star_base_names)
     num_pages = math.ceil(num_stars / page_size)
 
-    is_chokepoint_p = get_is_chokepoint_p(rng)
+    print(cf.yellow("Generating galaxy map..."))
+
+    hyperlanes = generate_hyperlanes(
+        rng, num_stars, hyperlane_density=get_settings().hyperlane_density
+    )
+    # systems with a single hyperlane are choke points
+    is_chokepoint = hyperlanes.degree(np.arange(num_stars)) == 1
+
+    stars = []
 
     for i in range(num_pages):
         if i == num_pages - 1 and num_stars % page_size != 0:
             page_size = num_stars % page_size
 
-        add_stars(
-            engine=engine,
-            rng=rng,
-            i=i,
-            star_base_names=star_base_names,
-            page_size=page_size,
-            is_chokepoint_p=is_chokepoint_p,
+        start = len(stars)
+
+        stars.extend(
+            add_stars(
+                writer=writer,
+                ids=ids,
+                rng=rng,
+                i=i,
+                star_base_names=star_base_names,
+                page_size=page_size,
+                is_chokepoint=is_chokepoint[start : start + page_size],
+            )
         )
 
+    writer.barrier()
+
+    return pd.DataFrame(stars), hyperlanes
+
 
 def add_stars(
     *,
-    engine: Engine,
+    writer: BackgroundWriter,
+    ids: IdAllocator,
     rng: np.random.Generator,
     i: int,
     star_base_names: list[str],
     page_size: int,
-    is_chokepoint_p: float,
+    is_chokepoint: np.ndarray,
 ):
     star_ids = stars_type_df().index
     star_id_weights = stars_type_df()["star_type_weight_pct"]
 
     sep = 50
 
-    with get_session(engine) as session:
-        session.execute(
-            insert(StarSystem),
-            [
-                {
-                    "star_system_name": f"{star_base_name}-{suffix}",
-                    "star_type_id": star_type_id,
-                    "system_is_choke_point": is_chokepoint,
-                }
-                for star_base_name, star_type_id, suffix, is_chokepoint in zip(
-                    star_base_names,
-                    rng.choice(
-                        star_ids,
-                        size=page_size,
-                        p=star_id_weights,
-                        replace=True,
-                    ).tolist(),
-                    rng.integers(
-                        size=page_size, low=i * sep + 1, high=i * sep + sep
-                    ),
-                    rng.binomial(
-                        1,
-                        p=is_chokepoint_p,
-                        size=page_size,
-                    ).astype(bool),
-                )
-            ],
+    stars = [
+        {
+            "star_system_id": int(star_system_id),
+            "star_system_name": f"{star_base_name}-{suffix}",
+            "star_type_id": star_type_id,
+            "system_is_choke_point": is_chokepoint,
+        }
+        for star_system_id, star_base_name, star_type_id, suffix, is_chokepoint in zip(
+            ids.allocate(StarSystem, page_size),
+            star_base_names,
+            rng.choice(
+                star_ids,
+                size=page_size,
+                p=star_id_weights,
+                replace=True,
+            ).tolist(),
+            rng.integers(size=page_size, low=i * sep + 1, high=i * sep + sep),
+            is_chokepoint.tolist(),
         )
-
-
-def connect_graph(g: nx.Graph):
-    while not nx.is_connected(g):
-        # get the connected components
-        connected_components = list(nx.connected_components(g))
-        # get the nodes in the first component
-        nodes = list(connected_components[0])
-        # get the nodes in the second component
-        nodes2 = list(connected_components[1])
-        # add an edge between the two nodes
-        g.add_edge(nodes[0], nodes2[0])
-
-
-def generate_clusters(rng: np.random.Generator, n_clusters: int):
-    print("Generating clusters...")
-
-    nodes_per_cluster = 12
-    clusters = [
-        nx.fast_gnp_random_graph(nodes_per_cluster, p, seed=rng)
-        for p in rng.normal(0.25, 0.005, n_clusters)
     ]
-    # relabel the nodes
-    clusters = [
-        nx.relabel_nodes(g, {n: f"node_{i}_{n}" for n in g.nodes})
-        for i, g in enumerate(clusters)
-    ]
-    # make sure each cluster is connected
-    for g in clusters:
-        connect_graph(g)
-
-    return clusters
-
-
-def connect_clusters(
-    combined: nx.Graph, rng: np.random.Generator, n_clusters: int
-):
-    hyperlanes_between_cluster = rng.poisson(
-        get_settings().hyperlane_density + 1, n_clusters
-    )
-    connected_components = list(nx.connected_components(combined))
-    for i, (cc, n_hyper) in enumerate(
-        zip(connected_components, hyperlanes_between_cluster)
-    ):
-        j = i + 1 if i + 1 < len(connected_components) else 0
-
-        # make sure don't choose too many nodes
-        cc2 = connected_components[j]
-        n_conn = min(len(cc), len(cc2), n_hyper)
-
-        # randomly choose n_hyper nodes from each cluster
-        nodes1 = rng.choice(list(cc), n_conn, replace=False)
-        nodes2 = rng.choice(list(cc2), n_conn, replace=False)
-
-        # add edges between the two nodes
-        for n1, n2 in zip(nodes1, nodes2):
-            combined.add_edge(n1, n2)
-
-    connect_graph(combined)
-
-
-def generate_hyperlane_map(rng: np.random.Generator, n_clusters: int):
-    # n_stars is how many clusters to simulate
-    print("Generating galaxy map...")
-    # mean number of edges to draw between clusters
-
-    combined = nx.compose_all(generate_clusters(rng, n_clusters))
-    connect_clusters(combined, rng, n_clusters)
-
-    return combined
-
-
-def get_is_chokepoint_p(rng: np.random.Generator):
-    n_clusters = int(
-        get_yhat(
-            get_settings().num_stars,
-            *get_m_and_b(MIN_NUM_STARS, 1000, MAX_NUM_STARS, 2000),
-        )
-    )
 
-    g = generate_hyperlane_map(rng, n_clusters)
+    writer.write(StarSystem, pd.DataFrame(stars))
 
-    # get the pct of num verticies with degree 1
-    return sum([1 for v in g.nodes if g.degree[v] == 1]) / len(g.nodes)
+    return stars
 
 
 __all__ = [
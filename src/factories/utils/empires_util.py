@@ -3,11 +3,11 @@ import os
 from functools import lru_cache
 
 import colorful as cf
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel, computed_field
 from sqlalchemy import Engine, func, select
 
-from src.database.db import get_session
 from src.models import Empire, EmpireToEthic, Planet, StarSystem
 from src.util import get_location
 
@@ -75,21 +75,6 @@ def ethic_df():
     return get_empire_info().ethics_df
 
 
-def empire_id_range(engine: Engine) -> tuple[int, int]:
-    """
-    Returns the minimum and maximum empire ids.
-    Assumes ids are auto generated by the database
-    """
-    with get_session(engine) as session:
-        min_id = session.scalar(
-            select(Empire.empire_id).order_by(Empire.empire_id.asc()).limit(1)
-        )
-        max_id = session.scalar(
-            select(Empire.empire_id).order_by(Empire.empire_id.desc()).limit(1)
-        )
-    return min_id, max_id
-
-
 @lru_cache(maxsize=1)
 def empires_info(engine: Engine):
     """
@@ -127,6 +112,25 @@ def empires_info(engine: Engine):
     return df
 
 
+def ethic_attraction_matrix(empires: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the (n_empires, n_ethics) matrix of each empire's attraction to
+    each ethic from the list columns of empires_info. Rows follow the order
+    of the dataframe, columns follow ethic_df().
+    """
+    num_ethics = empires["empire_ethic_id"].str.len().to_numpy()
+
+    matrix = np.zeros((len(empires), len(ethic_df())), dtype=int)
+    matrix[
+        np.repeat(np.arange(len(empires)), num_ethics),
+        ethic_df().index.get_indexer(
+            np.concatenate(empires["empire_ethic_id"].to_numpy())
+        ),
+    ] = np.concatenate(empires["empire_ethic_attraction"].to_numpy())
+
+    return matrix
+
+
 def get_empire_resources(engine):
     return pd.read_sql(
         select(
@@ -0,0 +1,210 @@
+from typing import NamedTuple
+
+import numpy as np
+
+NODES_PER_CLUSTER = 12
+
+
+class Hyperlanes(NamedTuple):
+    """
+    Undirected hyperlane graph in CSR form. The neighbors of node i are
+    indices[indptr[i]:indptr[i + 1]].
+    """
+
+    indptr: np.ndarray
+    indices: np.ndarray
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    def degree(self, nodes: np.ndarray) -> np.ndarray:
+        return self.indptr[nodes + 1] - self.indptr[nodes]
+
+    def neighbors(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the neighbors of all nodes and the position in nodes of the
+        node each neighbor belongs to
+        """
+        degree = self.degree(nodes)
+        starts = np.repeat(self.indptr[nodes], degree)
+        offsets = np.arange(degree.sum()) - np.repeat(
+            np.cumsum(degree) - degree, degree
+        )
+
+        return (
+            self.indices[starts + offsets],
+            np.repeat(np.arange(len(nodes)), degree),
+        )
+
+
+def to_csr(src: np.ndarray, dst: np.ndarray, num_nodes: int) -> Hyperlanes:
+    """
+    Converts an edge list into a symmetric CSR graph without self loops or
+    duplicate edges
+    """
+    src, dst = np.concatenate((src, dst)), np.concatenate((dst, src))
+
+    edges = np.unique(src[src != dst] * num_nodes + dst[src != dst])
+    src, dst = edges // num_nodes, edges % num_nodes
+
+    return Hyperlanes(
+        indptr=np.concatenate(
+            ([0], np.cumsum(np.bincount(src, minlength=num_nodes)))
+        ),
+        indices=dst,
+    )
+
+
+def component_labels(
+    src: np.ndarray, dst: np.ndarray, num_nodes: int
+) -> np.ndarray:
+    """
+    Labels every node with the smallest node of its connected component
+    """
+    labels = np.arange(num_nodes)
+
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, src, labels[dst])
+        np.minimum.at(new_labels, dst, labels[src])
+
+        if (new_labels == labels).all():
+            return labels
+
+        labels = new_labels
+
+
+def generate_hyperlanes(
+    rng: np.random.Generator, num_nodes: int, *, hyperlane_density: float
+) -> Hyperlanes:
+    """
+    Generates a galaxy map of consecutive clusters of NODES_PER_CLUSTER
+    star systems. Each cluster is a connected random graph and every cluster
+    has a few hyperlanes to the next one (the last wraps to the first).
+    """
+    cluster = np.arange(num_nodes) // NODES_PER_CLUSTER
+    cluster_start = cluster * NODES_PER_CLUSTER
+    n_clusters = cluster[-1] + 1
+    cluster_size = np.minimum(
+        num_nodes - np.arange(n_clusters) * NODES_PER_CLUSTER,
+        NODES_PER_CLUSTER,
+    )
+
+    # G(n, p) edges inside each cluster
+    i, j = np.triu_indices(NODES_PER_CLUSTER, k=1)
+    p = rng.normal(0.25, 0.005, n_clusters)
+    gnp = rng.random((n_clusters, len(i))) < p.reshape(-1, 1)
+    gnp &= j < cluster_size.reshape(-1, 1)
+    gnp_cluster, gnp_edge = np.nonzero(gnp)
+    gnp_src = gnp_cluster * NODES_PER_CLUSTER + i[gnp_edge]
+    gnp_dst = gnp_cluster * NODES_PER_CLUSTER + j[gnp_edge]
+
+    # one hyperlane from every other component of a cluster to the
+    # component of its first node, so every cluster is connected
+    nodes = np.arange(num_nodes)
+    roots = nodes[
+        (component_labels(gnp_src, gnp_dst, num_nodes) == nodes)
+        & (nodes != cluster_start)
+    ]
+
+    # hyperlanes between neighbouring clusters
+    n_lanes = np.maximum(rng.poisson(hyperlane_density + 1, n_clusters), 1)
+    lane_cluster = np.repeat(np.arange(n_clusters), n_lanes)
+    next_cluster = (lane_cluster + 1) % n_clusters
+
+    def random_node(clusters: np.ndarray):
+        return clusters * NODES_PER_CLUSTER + (
+            rng.random(len(clusters)) * cluster_size[clusters]
+        ).astype(int)
+
+    return to_csr(
+        np.concatenate(
+            (
+                gnp_src,
+                roots,
+                random_node(lane_cluster),
+            )
+        ),
+        np.concatenate(
+            (
+                gnp_dst,
+                cluster_start[roots],
+                random_node(next_cluster),
+            )
+        ),
+        num_nodes,
+    )
+
+
+def grow_territories(
+    hyperlanes: Hyperlanes,
+    rng: np.random.Generator,
+    *,
+    homes: np.ndarray,
+    num_systems: np.ndarray,
+) -> np.ndarray:
+    """
+    Multi-source BFS from every home node. Each source grows level by level
+    until it owns num_systems extra nodes. Nodes reached by several sources
+    in the same level go to a random one of them. A source surrounded by
+    other territories settles a random unowned node and keeps growing from
+    there, so every source gets its num_systems nodes while any are left.
+
+    Returns the index (into homes) of the owner of every node, -1 if
+    unowned.
+    """
+    owner = np.full(hyperlanes.num_nodes, -1)
+    owner[homes] = np.arange(len(homes))
+    remaining = np.maximum(num_systems, 0)
+    num_unowned = hyperlanes.num_nodes - len(homes)
+
+    # owned nodes that can still grow
+    frontier = homes
+
+    while remaining.any() and num_unowned > 0:
+        frontier = frontier[remaining[owner[frontier]] > 0]
+
+        nodes, parent = hyperlanes.neighbors(frontier)
+        claimed_by = owner[frontier][parent]
+
+        # nodes without unowned neighbours can't grow anymore
+        unowned = owner[nodes] == -1
+        frontier = frontier[
+            np.bincount(parent[unowned], minlength=len(frontier)) > 0
+        ]
+        nodes, claimed_by = nodes[unowned], claimed_by[unowned]
+
+        # contested nodes go to a random neighbour
+        shuffle = rng.permutation(len(nodes))
+        nodes, first = np.unique(nodes[shuffle], return_index=True)
+        claimed_by = claimed_by[shuffle][first]
+
+        # keep a random subset of each owner's claims within its quota
+        order = np.lexsort((rng.random(len(nodes)), claimed_by))
+        nodes, claimed_by = nodes[order], claimed_by[order]
+        rank = np.arange(len(nodes)) - np.searchsorted(claimed_by, claimed_by)
+        within_quota = rank < remaining[claimed_by]
+        nodes, claimed_by = nodes[within_quota], claimed_by[within_quota]
+
+        # sources boxed in by other territories settle a random unowned node
+        boxed_in = (remaining > 0) & (
+            np.bincount(owner[frontier], minlength=len(homes)) == 0
+        )
+
+        if boxed_in.any():
+            boxed_in = rng.permutation(np.flatnonzero(boxed_in))
+            free = np.setdiff1d(np.flatnonzero(owner == -1), nodes)
+            seeds = rng.choice(
+                free, size=min(len(boxed_in), len(free)), replace=False
+            )
+            nodes = np.concatenate((nodes, seeds))
+            claimed_by = np.concatenate((claimed_by, boxed_in[: len(seeds)]))
+
+        owner[nodes] = claimed_by
+        remaining -= np.bincount(claimed_by, minlength=len(homes))
+        num_unowned -= len(nodes)
+
+        frontier = np.concatenate((frontier, nodes))
+
+    return owner
@@ -0,0 +1,64 @@
+import colorful as cf
+import numpy as np
+from sqlalchemy import Engine, func, select
+
+from src.database.base import Base
+from src.database.db import get_session
+
+from .util import STARTING_ID
+
+
+class IdAllocator:
+    """
+    Assigns primary keys on the client, in generation order, so rows are
+    inserted with their ids and foreign keys can be wired in memory instead
+    of reading the ids back from the database. Every table of a galaxy must
+    get its ids from the same allocator.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._next_id: dict[type[Base], int] = {}
+
+    def allocate(self, model: type[Base], count: int) -> np.ndarray:
+        """
+        Returns the next count ids of the model's table
+        """
+        start = self._next_id.get(model, STARTING_ID)
+        self._next_id[model] = start + int(count)
+
+        return np.arange(start, start + count)
+
+    def ids(self, model: type[Base]) -> np.ndarray:
+        """
+        Returns every id allocated so far for the model's table
+        """
+        return np.arange(STARTING_ID, self._next_id.get(model, STARTING_ID))
+
+    def reset_sequences(self):
+        """
+        Moves the postgresql sequences past the allocated ids. MySQL, MariaDB
+        and SQLite continue from the largest id on their own.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return
+
+        print(cf.yellow("Resetting id sequences..."))
+
+        with get_session(self.engine) as session:
+            for model, next_id in self._next_id.items():
+                if next_id == STARTING_ID:
+                    continue
+
+                (pk,) = model.__table__.primary_key.columns
+
+                session.execute(
+                    select(
+                        func.setval(
+                            func.pg_get_serial_sequence(
+                                model.__tablename__, pk.name
+                            ),
+                            next_id - 1,
+                        )
+                    )
+                )
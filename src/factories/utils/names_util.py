@@ -0,0 +1,107 @@
+import os
+from functools import lru_cache
+
+import colorful as cf
+import numpy as np
+from faker import VERSION as FAKER_VERSION
+from faker.providers.person.en_US import Provider as PersonProvider
+
+from src.util import get_location
+
+
+class NamePool:
+    """
+    Weighted pools of first and last names. Names are drawn with numpy
+    index sampling, so they only depend on the rng and millions can be
+    drawn at once.
+    """
+
+    def __init__(self, pools: dict[str, np.ndarray]):
+        self.first_names = pools["first_names"].astype(object)
+        self.first_name_weights = pools["first_name_weights"]
+        self.last_names = pools["last_names"].astype(object)
+        self.last_name_weights = pools["last_name_weights"]
+
+    @staticmethod
+    def build_pools() -> dict[str, np.ndarray]:
+        def weighted(names: dict[str, float]):
+            weights = np.array(list(names.values()))
+            return np.array(list(names)), weights / weights.sum()
+
+        first_names, first_name_weights = weighted(PersonProvider.first_names)
+        last_names, last_name_weights = weighted(PersonProvider.last_names)
+
+        return {
+            "first_names": first_names,
+            "first_name_weights": first_name_weights,
+            "last_names": last_names,
+            "last_name_weights": last_name_weights,
+        }
+
+    @classmethod
+    def load(cls, path: str) -> "NamePool":
+        """
+        Loads the pools from path, building and caching them there if
+        needed
+        """
+        if os.path.exists(path):
+            print(cf.yellow(f"Loading name pool from {path}"))
+            with np.load(path) as f:
+                return cls(dict(f))
+
+        print(cf.yellow(f"Building name pool {path}"))
+        pools = cls.build_pools()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, **pools)
+
+        return cls(pools)
+
+    @property
+    def num_unique_names(self) -> int:
+        return len(self.first_names) * len(self.last_names)
+
+    def draw(
+        self, rng: np.random.Generator, size: int, *, unique: bool = False
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the first and last name indices of size names. Unique names
+        are drawn uniformly from every first and last name combination.
+        """
+        if unique:
+            first, last = np.divmod(
+                rng.choice(self.num_unique_names, size, replace=False),
+                len(self.last_names),
+            )
+        else:
+            first = rng.choice(
+                len(self.first_names), size, p=self.first_name_weights
+            )
+            last = rng.choice(
+                len(self.last_names), size, p=self.last_name_weights
+            )
+
+        return first, last
+
+    def join(self, first: np.ndarray, last: np.ndarray) -> np.ndarray:
+        """
+        Returns the "first last" names of drawn indices
+        """
+        return self.first_names[first] + " " + self.last_names[last]
+
+    def names(
+        self, rng: np.random.Generator, size: int, *, unique: bool = False
+    ) -> np.ndarray:
+        """
+        Returns size "first last" names
+        """
+        return self.join(*self.draw(rng, size, unique=unique))
+
+
+@lru_cache()
+def name_pool() -> NamePool:
+    name_pool_file = f"../../../data/name_pool-{FAKER_VERSION}.npz"
+
+    return NamePool.load(
+        os.path.normpath(os.path.join(get_location(), name_pool_file))
+    )
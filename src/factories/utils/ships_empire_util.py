@@ -5,104 +5,68 @@ import pandas as pd
 from sqlalchemy import Engine
 
 from .empires_util import empires_info
-from .ships_util import ship_class_df, ship_class_rank
+from .ships_util import ship_class_df, ship_class_rank, ships_info
+
+
+def can_build(df: pd.DataFrame, ship_class: str) -> pd.Series:
+    return df["max_ship_class_rank"] >= ship_class_rank()[ship_class]
 
 
-# TODO: many of these names are hard coded - should rely on the config files
 def calculate_special_fleet_comp(df: pd.DataFrame) -> pd.DataFrame:
-    def calc_ship_limit(
-        df_app: pd.DataFrame,
-        ship_class: str,
-        command_limit_req: int,
-        max_clamp: int = np.inf,
-    ):
-        return (
-            min(df_app["command_limit"] // command_limit_req, max_clamp)
-            if df_app["max_ship_class_rank"] >= ship_class_rank()[ship_class]
-            else 0
+    for ship_class in ships_info().ship_class:
+        composition = ship_class.fleet_composition
+
+        if composition.command_limit_per_ship is None:
+            continue
+
+        df[f"num_{ship_class.name}"] = np.where(
+            can_build(df, ship_class.name),
+            (df["command_limit"] // composition.command_limit_per_ship).clip(
+                upper=composition.max_ships
+            ),
+            0,
         )
 
-    df["num_star_eater"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("star_eater", 1, 1),
-    )
-    df["num_colossus"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("colossus", 160),
-    )
-    df["num_juggernaut"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("juggernaut", 80),
-    )
-    df["num_titan"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("titan", 20),
-    )
-
     return df
 
 
 def calculate_regular_fleet_comp(
     df: pd.DataFrame, rng: np.random.Generator
 ) -> pd.DataFrame:
-    min_pct = 3.125
-
-    def calc_ship_limit(
-        df_app: pd.Series,
-        ship_class: str,
-        pct: float,
-    ):
-        pct += rng.normal(0, 0.125)
-
-        return (
-            int(df_app["command_limit"] * (pct / 100))
-            if df_app["max_ship_class_rank"] >= ship_class_rank()[ship_class]
-            else 0
-        )
+    regular = [
+        ship_class
+        for ship_class in ships_info().ship_class
+        if ship_class.fleet_composition.command_limit_pct is not None
+    ]
+    pct_noise = rng.normal(0, 0.125, size=(len(regular), len(df)))
 
-    df["num_battleship"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("battleship", min_pct),
-    )
-    df["num_cruiser"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("cruiser", min_pct * 2),
-    )
-    df["num_destroyer"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("destroyer", min_pct * 4),
-    )
-    df["num_frigate"] = df.apply(
-        calc_ship_limit,
-        axis=1,
-        args=("frigate", min_pct * 8),
-    )
+    for ship_class, noise in zip(regular, pct_noise):
+        pct = ship_class.fleet_composition.command_limit_pct + noise
+
+        df[f"num_{ship_class.name}"] = np.where(
+            can_build(df, ship_class.name),
+            (df["command_limit"] * (pct / 100)).astype(int),
+            0,
+        )
 
-    # remainder of command limit is corvettes
-    df["num_corvette"] = (
+    # remainder of command limit, clamped to min 0
+    ship_cols = [
+        f"num_{ship_class.name}"
+        for ship_class in ships_info().ship_class
+        if not ship_class.fleet_composition.remainder
+    ]
+    remainder = (
         df["command_limit"]
-        - (
-            df["num_titan"]
-            + df["num_juggernaut"]
-            + df["num_colossus"]
-            + df["num_star_eater"]
-            + df["num_battleship"]
-            + df["num_cruiser"]
-            + df["num_destroyer"]
-            + df["num_frigate"]
-            + rng.integers(
-                0, max(np.ceil(df["command_limit"].mean() / 10), 2), len(df)
-            )
+        - df[ship_cols].sum(axis=1)
+        - rng.integers(
+            0, max(np.ceil(df["command_limit"].mean() / 10), 2), len(df)
         )
     ).clip(0)
-    # clamp corvettes to min 0
+
+    for ship_class in ships_info().ship_class:
+        if ship_class.fleet_composition.remainder:
+            df[f"num_{ship_class.name}"] = remainder
+
     return df
 
 
@@ -133,16 +97,11 @@ def empire_fleet_info(engine: Engine, rng: np.random.Generator):
         for row in rng.integers(capital_a, capital_z + 1, size=(len(df), 3))
     ]
 
-    df["total_ships"] = (
-        df["num_titan"]
-        + df["num_juggernaut"]
-        + df["num_colossus"]
-        + df["num_star_eater"]
-        + df["num_battleship"]
-        + df["num_cruiser"]
-        + df["num_destroyer"]
-        + df["num_frigate"]
-        + df["num_corvette"]
-    )
+    df["total_ships"] = df[
+        [
+            f"num_{ship_class}"
+            for ship_class in ship_class_df()["ship_class_name"]
+        ]
+    ].sum(axis=1)
 
     return df
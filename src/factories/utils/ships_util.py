@@ -2,6 +2,7 @@ import json
 import os
 from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel, Field, computed_field
 
@@ -24,11 +25,22 @@ class ShipWeaponInfo(BaseModel):
     star_eater: int = weapon_field
 
 
+class ShipFleetComposition(BaseModel):
+    # one ship per command_limit_per_ship of the empire command limit
+    command_limit_per_ship: int | None = Field(None, gt=0)
+    max_ships: int | None = Field(None, ge=0)
+    # percentage of the empire command limit
+    command_limit_pct: float | None = Field(None, ge=0)
+    # what is left of the empire command limit
+    remainder: bool = False
+
+
 class ShipClassInfo(BaseModel):
     name: str
     weapons: ShipWeaponInfo
     command_points: int
     crew: int
+    fleet_composition: ShipFleetComposition
 
 
 class ShipWeaponModInfo(BaseModel):
@@ -136,6 +148,32 @@ def ship_class_rank() -> dict[str, int]:
     }
 
 
+@lru_cache()
+def ship_ranks_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        ships_info().model_dump(include=["ranks"])["ranks"]
+    ).sort_values("spaceship_min_experience")
+
+
+def ship_rank_multiplier(experience: np.ndarray) -> np.ndarray:
+    """
+    Returns the power multiplier (1 + rank bonus) of each ship experience.
+    Experience outside of every rank gives 0.
+    """
+    ranks = ship_ranks_df()
+    rank = (
+        np.searchsorted(
+            ranks["spaceship_min_experience"], experience, side="right"
+        )
+        - 1
+    )
+    in_rank = (rank >= 0) & (
+        experience <= ranks["spaceship_max_experience"].to_numpy()[rank]
+    )
+
+    return (1 + ranks["spaceship_bonus_power"].to_numpy()[rank]) * in_rank
+
+
 @lru_cache()
 def ships_info():
     ship_info_file = "../assets/ships.json"
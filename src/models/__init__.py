@@ -1,6 +1,8 @@
 from .crew import *
 from .empire import *
 from .fleet import *
+from .pg_empire_score import *
+from .pg_fleet_power import *
 from .pg_ship import *
 from .ship import *
 from .star_system import *
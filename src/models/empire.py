@@ -33,6 +33,24 @@ class EmpireEthic(Base):
     )
 
 
+# empire_score is the weighted sum of these columns (fleet power is rounded)
+EMPIRE_SCORE_WEIGHTS = {
+    # economic strength
+    "empire_total_energy": 1,
+    "empire_total_minerals": 1,
+    # technology
+    "empire_total_research": 6,
+    # economy
+    "empire_total_trade": 1,
+    # expansion
+    "empire_num_systems": 10000,
+    "empire_colonies_count": 50000,
+    "empire_num_pops": 20000,
+    # fleet power
+    "empire_fleet_power": 1,
+}
+
+
 class Empire(Base):
     __tablename__ = "empire"
 
@@ -43,6 +61,17 @@ class Empire(Base):
     )
     empire_score: Mapped[int] = mapped_column(default=0)
 
+    # components of the empire score (see EMPIRE_SCORE_WEIGHTS)
+    empire_total_energy: Mapped[int] = mapped_column(default=0)
+    empire_total_minerals: Mapped[int] = mapped_column(default=0)
+    empire_total_research: Mapped[int] = mapped_column(default=0)
+    empire_total_trade: Mapped[int] = mapped_column(default=0)
+    empire_num_systems: Mapped[int] = mapped_column(default=0)
+    empire_colonies_count: Mapped[int] = mapped_column(default=0)
+    empire_num_pops: Mapped[int] = mapped_column(default=0)
+    # sum of the power of every fleet of the empire
+    empire_fleet_power: Mapped[float] = mapped_column(default=0)
+
     fleets: Mapped[list["Fleet"]] = relationship(
         "Fleet", back_populates="empire"
     )
@@ -81,6 +110,7 @@ class EmpireToEthic(Base):
 
 
 __all__ = [
+    "EMPIRE_SCORE_WEIGHTS",
     "EmpireAuthority",
     "EmpireEthic",
     "Empire",
@@ -19,6 +19,8 @@ class Fleet(Base):
     )
     fleet_cloak_strength: Mapped[int]
     fleet_is_docked: Mapped[bool]
+    # sum of the power of every ship in the fleet
+    fleet_power: Mapped[float] = mapped_column(default=0)
 
     empire: Mapped["Empire"] = relationship("Empire", back_populates="fleets")
     ships: Mapped[list["Spaceship"]] = relationship("Spaceship")
@@ -0,0 +1,238 @@
+import colorful as cf
+from sqlalchemy import Engine, text
+
+from src.database.db import get_session
+
+from .empire import EMPIRE_SCORE_WEIGHTS
+
+# fleet power is kept up to date by the fleet power triggers
+_planet_components = [
+    "empire_total_energy",
+    "empire_total_minerals",
+    "empire_total_research",
+    "empire_total_trade",
+    "empire_num_systems",
+    "empire_colonies_count",
+    "empire_num_pops",
+]
+
+_delta_params = ", ".join(f"d_{col} BIGINT" for col in _planet_components)
+_delta_set = ", ".join(
+    f"{col} = {col} + d_{col}" for col in _planet_components
+)
+_delta_score = " + ".join(
+    f"d_{col} * {EMPIRE_SCORE_WEIGHTS[col]}" for col in _planet_components
+)
+
+pg_apply_empire_score_delta = text(
+    f"""
+    CREATE OR REPLACE FUNCTION apply_empire_score_delta(
+        p_empire_id INTEGER,
+        {_delta_params}
+    )
+        RETURNS VOID AS
+    $$
+    BEGIN
+        -- planets in unowned star systems do not count towards any score
+        IF p_empire_id IS NULL THEN
+            RETURN;
+        END IF;
+
+        UPDATE empire SET
+            {_delta_set},
+            empire_score = empire_score + {_delta_score}
+        WHERE empire_id = p_empire_id;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_planet_empire_score = text(
+    """
+    CREATE OR REPLACE FUNCTION planet_empire_score_fnc()
+        RETURNS TRIGGER AS
+    $$
+    DECLARE
+        owner INTEGER;
+        habitable INTEGER;
+    BEGIN
+        -- remove the old planet from its owner's score
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            SELECT INTO owner empire_owner
+            FROM star_system
+            WHERE star_system_id = OLD.planet_star_system;
+
+            SELECT INTO habitable biome_is_habitable::INTEGER
+            FROM biome
+            WHERE biome_id = OLD.planet_biome;
+
+            PERFORM apply_empire_score_delta(
+                owner,
+                -OLD.planet_energy_value,
+                -OLD.planet_minerals_value,
+                -OLD.planet_research_value,
+                -OLD.planet_trade_value,
+                0,
+                -habitable,
+                -OLD.planet_pops * habitable
+            );
+        END IF;
+
+        -- add the new planet to its owner's score
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            SELECT INTO owner empire_owner
+            FROM star_system
+            WHERE star_system_id = NEW.planet_star_system;
+
+            SELECT INTO habitable biome_is_habitable::INTEGER
+            FROM biome
+            WHERE biome_id = NEW.planet_biome;
+
+            PERFORM apply_empire_score_delta(
+                owner,
+                NEW.planet_energy_value,
+                NEW.planet_minerals_value,
+                NEW.planet_research_value,
+                NEW.planet_trade_value,
+                0,
+                habitable,
+                NEW.planet_pops * habitable
+            );
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_1 = text(
+    """
+    DROP TRIGGER IF EXISTS planet_empire_score_trg ON planet;
+    """
+)
+pg_trg_2 = text(
+    """
+    CREATE TRIGGER planet_empire_score_trg
+    AFTER INSERT OR UPDATE OR DELETE ON planet
+    FOR EACH ROW EXECUTE PROCEDURE planet_empire_score_fnc();
+    """
+)
+pg_star_system_empire_score = text(
+    """
+    CREATE OR REPLACE FUNCTION star_system_empire_score_fnc()
+        RETURNS TRIGGER AS
+    $$
+    DECLARE
+        system_id INTEGER;
+        system_energy BIGINT;
+        system_minerals BIGINT;
+        system_research BIGINT;
+        system_trade BIGINT;
+        system_colonies BIGINT;
+        system_pops BIGINT;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            system_id := OLD.star_system_id;
+        ELSE
+            system_id := NEW.star_system_id;
+        END IF;
+
+        IF TG_OP = 'UPDATE' THEN
+            IF NEW.empire_owner IS NOT DISTINCT FROM OLD.empire_owner THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+
+        -- the planets of the system move to the new owner
+        SELECT
+            COALESCE(SUM(planet_energy_value), 0),
+            COALESCE(SUM(planet_minerals_value), 0),
+            COALESCE(SUM(planet_research_value), 0),
+            COALESCE(SUM(planet_trade_value), 0),
+            COUNT(planet_id) FILTER (WHERE biome_is_habitable),
+            COALESCE(SUM(planet_pops) FILTER (WHERE biome_is_habitable), 0)
+        INTO
+            system_energy,
+            system_minerals,
+            system_research,
+            system_trade,
+            system_colonies,
+            system_pops
+        FROM planet
+        JOIN biome ON biome.biome_id = planet.planet_biome
+        WHERE planet_star_system = system_id;
+
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM apply_empire_score_delta(
+                OLD.empire_owner,
+                -system_energy,
+                -system_minerals,
+                -system_research,
+                -system_trade,
+                -1,
+                -system_colonies,
+                -system_pops
+            );
+        END IF;
+
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM apply_empire_score_delta(
+                NEW.empire_owner,
+                system_energy,
+                system_minerals,
+                system_research,
+                system_trade,
+                1,
+                system_colonies,
+                system_pops
+            );
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_3 = text(
+    """
+    DROP TRIGGER IF EXISTS star_system_empire_score_trg ON star_system;
+    """
+)
+pg_trg_4 = text(
+    """
+    CREATE TRIGGER star_system_empire_score_trg
+    AFTER INSERT OR UPDATE OF empire_owner OR DELETE ON star_system
+    FOR EACH ROW EXECUTE PROCEDURE star_system_empire_score_fnc();
+    """
+)
+
+
+def add_empire_score_triggers(engine: Engine):
+    """
+    Keeps empire scores up to date when planets or star systems change.
+    Must be added after the scores have been calculated.
+    """
+    if engine.dialect.name != "postgresql":
+        print(
+            cf.orange(
+                f"WARNING: Empire score triggers for {engine.dialect.name} "
+                f"database have not been implemented. Call "
+                f"src.factories.empire_score.apply_empire_score_delta when "
+                f"changing planets or star systems"
+            )
+        )
+        return
+
+    with get_session(engine) as session:
+        session.execute(pg_apply_empire_score_delta)
+        session.execute(pg_planet_empire_score)
+        session.execute(pg_trg_1)
+        session.execute(pg_trg_2)
+        session.execute(pg_star_system_empire_score)
+        session.execute(pg_trg_3)
+        session.execute(pg_trg_4)
+
+
+__all__ = ["add_empire_score_triggers"]
@@ -0,0 +1,293 @@
+import colorful as cf
+from sqlalchemy import Engine, text
+
+from src.database.db import get_session
+
+pg_refresh_template_power = text(
+    """
+    CREATE OR REPLACE FUNCTION refresh_template_power(
+        p_template_id INTEGER
+    )
+        RETURNS VOID AS
+    $$
+    BEGIN
+        UPDATE ship_template SET ship_template_power = (
+            SELECT COALESCE(SUM(ship_module_count * spaceship_module_power), 0)
+            FROM ship_template_to_module
+            JOIN spaceship_module
+                ON spaceship_module.spaceship_module_id = ship_template_to_module.ship_module_id
+            WHERE ship_template_to_module.ship_template_id = p_template_id
+        )
+        WHERE ship_template_id = p_template_id;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_refresh_fleet_power = text(
+    """
+    CREATE OR REPLACE FUNCTION refresh_fleet_power(p_fleet_id INTEGER)
+        RETURNS VOID AS
+    $$
+    BEGIN
+        UPDATE fleet SET fleet_power = (
+            SELECT COALESCE(
+                SUM(ship_template_power * (1 + spaceship_bonus_power)), 0
+            )
+            FROM spaceship
+            JOIN ship_template
+                ON ship_template.ship_template_id = spaceship.spaceship_template_id
+            JOIN spaceship_rank
+                ON spaceship.spaceship_experience BETWEEN spaceship_rank.spaceship_min_experience
+                AND spaceship_rank.spaceship_max_experience
+            WHERE spaceship.spaceship_fleet_id = p_fleet_id
+        )
+        WHERE fleet_id = p_fleet_id;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_refresh_empire_fleet_power = text(
+    """
+    CREATE OR REPLACE FUNCTION refresh_empire_fleet_power(
+        p_empire_id INTEGER
+    )
+        RETURNS VOID AS
+    $$
+    DECLARE
+        new_power DOUBLE PRECISION;
+    BEGIN
+        IF p_empire_id IS NULL THEN
+            RETURN;
+        END IF;
+
+        SELECT INTO new_power COALESCE(SUM(fleet_power), 0)
+        FROM fleet
+        WHERE fleet_empire_owner = p_empire_id;
+
+        -- the score is adjusted by the change in fleet power
+        UPDATE empire SET
+            empire_score = empire_score
+                - ROUND(empire_fleet_power)
+                + ROUND(new_power),
+            empire_fleet_power = new_power
+        WHERE empire_id = p_empire_id;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_template_module_power = text(
+    """
+    CREATE OR REPLACE FUNCTION template_module_power_fnc()
+        RETURNS TRIGGER AS
+    $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM refresh_template_power(OLD.ship_template_id);
+        END IF;
+
+        IF TG_OP = 'INSERT' OR (
+            TG_OP = 'UPDATE'
+            AND NEW.ship_template_id != OLD.ship_template_id
+        ) THEN
+            PERFORM refresh_template_power(NEW.ship_template_id);
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_1 = text(
+    """
+    DROP TRIGGER IF EXISTS template_module_power_trg
+    ON ship_template_to_module;
+    """
+)
+pg_trg_2 = text(
+    """
+    CREATE TRIGGER template_module_power_trg
+    AFTER INSERT OR UPDATE OR DELETE ON ship_template_to_module
+    FOR EACH ROW EXECUTE PROCEDURE template_module_power_fnc();
+    """
+)
+pg_template_fleet_power = text(
+    """
+    CREATE OR REPLACE FUNCTION template_fleet_power_fnc()
+        RETURNS TRIGGER AS
+    $$
+    BEGIN
+        -- every fleet with a ship using the template
+        PERFORM refresh_fleet_power(fleet_id)
+        FROM (
+            SELECT DISTINCT spaceship_fleet_id AS fleet_id
+            FROM spaceship
+            WHERE spaceship_template_id = NEW.ship_template_id
+        ) AS fleets;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_3 = text(
+    """
+    DROP TRIGGER IF EXISTS template_fleet_power_trg ON ship_template;
+    """
+)
+pg_trg_4 = text(
+    """
+    CREATE TRIGGER template_fleet_power_trg
+    AFTER UPDATE OF ship_template_power ON ship_template
+    FOR EACH ROW
+    WHEN (NEW.ship_template_power IS DISTINCT FROM OLD.ship_template_power)
+    EXECUTE PROCEDURE template_fleet_power_fnc();
+    """
+)
+pg_spaceship_fleet_power = text(
+    """
+    CREATE OR REPLACE FUNCTION spaceship_fleet_power_fnc()
+        RETURNS TRIGGER AS
+    $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM refresh_fleet_power(OLD.spaceship_fleet_id);
+        END IF;
+
+        IF TG_OP = 'INSERT' OR (
+            TG_OP = 'UPDATE'
+            AND NEW.spaceship_fleet_id != OLD.spaceship_fleet_id
+        ) THEN
+            PERFORM refresh_fleet_power(NEW.spaceship_fleet_id);
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_5 = text(
+    """
+    DROP TRIGGER IF EXISTS spaceship_fleet_power_trg ON spaceship;
+    """
+)
+pg_trg_6 = text(
+    """
+    CREATE TRIGGER spaceship_fleet_power_trg
+    AFTER INSERT
+        OR UPDATE OF spaceship_fleet_id, spaceship_template_id, spaceship_experience
+        OR DELETE
+    ON spaceship
+    FOR EACH ROW EXECUTE PROCEDURE spaceship_fleet_power_fnc();
+    """
+)
+pg_rank_fleet_power = text(
+    """
+    CREATE OR REPLACE FUNCTION rank_fleet_power_fnc()
+        RETURNS TRIGGER AS
+    $$
+    BEGIN
+        -- a rank change can move every ship, refresh every fleet
+        PERFORM refresh_fleet_power(fleet_id) FROM fleet;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_7 = text(
+    """
+    DROP TRIGGER IF EXISTS rank_fleet_power_trg ON spaceship_rank;
+    """
+)
+pg_trg_8 = text(
+    """
+    CREATE TRIGGER rank_fleet_power_trg
+    AFTER INSERT OR UPDATE OR DELETE ON spaceship_rank
+    FOR EACH STATEMENT EXECUTE PROCEDURE rank_fleet_power_fnc();
+    """
+)
+pg_fleet_empire_power = text(
+    """
+    CREATE OR REPLACE FUNCTION fleet_empire_power_fnc()
+        RETURNS TRIGGER AS
+    $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM refresh_empire_fleet_power(OLD.fleet_empire_owner);
+        END IF;
+
+        IF TG_OP = 'INSERT' OR (
+            TG_OP = 'UPDATE'
+            AND NEW.fleet_empire_owner IS DISTINCT FROM OLD.fleet_empire_owner
+        ) THEN
+            PERFORM refresh_empire_fleet_power(NEW.fleet_empire_owner);
+        END IF;
+
+        RETURN NULL;
+    END;
+    $$
+    LANGUAGE plpgsql;
+    """
+)
+pg_trg_9 = text(
+    """
+    DROP TRIGGER IF EXISTS fleet_empire_power_trg ON fleet;
+    """
+)
+pg_trg_10 = text(
+    """
+    CREATE TRIGGER fleet_empire_power_trg
+    AFTER INSERT OR UPDATE OF fleet_power, fleet_empire_owner OR DELETE
+    ON fleet
+    FOR EACH ROW EXECUTE PROCEDURE fleet_empire_power_fnc();
+    """
+)
+
+
+def add_fleet_power_triggers(engine: Engine):
+    """
+    Keeps the template, fleet and empire fleet power rollups up to date
+    when template modules, ships, ranks or fleets change. Must be added
+    after the rollups have been calculated.
+    """
+    if engine.dialect.name != "postgresql":
+        print(
+            cf.orange(
+                f"WARNING: Fleet power triggers for {engine.dialect.name} "
+                f"database have not been implemented. Call "
+                f"src.factories.fleet_power.refresh_template_power or "
+                f"src.factories.fleet_power.refresh_fleet_power when "
+                f"changing ship templates or spaceships"
+            )
+        )
+        return
+
+    with get_session(engine) as session:
+        session.execute(pg_refresh_template_power)
+        session.execute(pg_refresh_fleet_power)
+        session.execute(pg_refresh_empire_fleet_power)
+        session.execute(pg_template_module_power)
+        session.execute(pg_trg_1)
+        session.execute(pg_trg_2)
+        session.execute(pg_template_fleet_power)
+        session.execute(pg_trg_3)
+        session.execute(pg_trg_4)
+        session.execute(pg_spaceship_fleet_power)
+        session.execute(pg_trg_5)
+        session.execute(pg_trg_6)
+        session.execute(pg_rank_fleet_power)
+        session.execute(pg_trg_7)
+        session.execute(pg_trg_8)
+        session.execute(pg_fleet_empire_power)
+        session.execute(pg_trg_9)
+        session.execute(pg_trg_10)
+
+
+__all__ = ["add_fleet_power_triggers"]
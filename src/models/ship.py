@@ -33,6 +33,8 @@ class ShipTemplate(Base):
         ForeignKey("ship_class.ship_class_id")
     )
     ship_template_name: Mapped[str] = mapped_column(String(255), unique=True)
+    # sum of the power of every module in the template
+    ship_template_power: Mapped[int] = mapped_column(default=0)
 
     template_modules: Mapped[list["SpaceshipModule"]] = relationship(
         secondary="ship_template_to_module",
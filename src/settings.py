@@ -132,6 +132,8 @@ class Settings(BaseSettings):
     # sqlalchemy
     target_databases: list[TargetDatabase] = []
     sqlalchemy_echo: bool = True
+    # connections loading the large tables in parallel on server databases
+    num_load_connections: int = Field(4, ge=1)
 
     # config
     random_seed: int = 1234